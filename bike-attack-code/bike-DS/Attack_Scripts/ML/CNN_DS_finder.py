@@ -1,6 +1,5 @@
 import numpy as np
 import tensorflow as tf
-import csv
 import time
 import os
 from tensorflow.keras.models import Sequential
@@ -8,6 +7,8 @@ from tensorflow.keras.layers import Conv1D
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.models import load_model
 
+import trace_data
+
 
 num_bits = 12323
 num_dist = (num_bits // 2) +1
@@ -64,103 +65,32 @@ def get_fully_connected_model():
 
 
 
+# keys and DS are read from the memory-mapped .npy companions of the trace
+# file (see trace_data.py), which are created on the first read
 def read_trace_file(how_many_to_read, filename):
-    
 
-    keys = []
-    DS = []
-    still_todo = how_many_to_read
-    with open(filename, 'r') as file:
-        reader = csv.reader(file)
-        for i, row in enumerate(reader):
-            
-
-            if i % 2 == 0:
-                # This is an even line (0-based index, so even number)
-                # Convert strings to integers
-                values = [int(value.strip()) for value in row]
-                keys.append(values)
-            else:
-                # This is an odd line (0-based index, so odd number)
-                # Convert strings to floats
-                values = [float(value.strip()) for value in row]
-                DS.append(values)
-                still_todo -= 1
-            
-            if still_todo == 0:
-                break
-        print(f"read {how_many_to_read- still_todo} traces")
+    keys, DS = trace_data.load_traces(filename, how_many_to_read)
+    print(f"read {len(DS)} traces")
     keys_array = np.array(keys)
-    DS_array = np.array(DS)
+    DS_array = np.array(DS, dtype=np.float64)
 
     return keys_array, DS_array
 
 
 
-def det_dist_in_spec(s, i):
-    a = 0
-    b = 0
-    if s < i:
-        a = s
-        b = i
-    else:
-        a = i
-        b = s
-    max_dist = num_bits // 2
-    if (b-a) > max_dist:
-        return num_bits - (b-a)
-    else:
-        return (b-a)
-    
-
-
-
+# the block and valley rules are dist_spec.block_center / valley_labels, one
+# folder up (imported by trace_data)
 def find_middle_position(wlist):
     """
-    Find the middle position of the only consecutive block in wlist 
-    that has length >= 30.
-    Returns the index (in wlist) of the middle element of that block.
+    Find the middle position of the longest consecutive block in wlist,
+    which must have length >= 30.
     """
-
-    max_start, max_len = 0, 0
-    current_start, current_len = 0, 1
-
-    for i in range(1, len(wlist)):
-        if wlist[i] == wlist[i-1] + 1: 
-            current_len += 1
-        else:
-            if current_len >= max_len:
-                max_len = current_len
-                max_start = current_start
-            current_start = i
-            current_len = 1
-
-    # check last
-    if current_len >= max_len:
-        max_len = current_len
-        max_start = current_start
-
-    if max_len < 30:
-        raise ValueError("No valid block in key")
-
-    middle_index = max_start + max_len // 2
-    return wlist[middle_index]
-
+    return trace_data.dist_spec.block_center(wlist)
 
 
 # get the respective label for the block
 def get_train_labels_from_key(wlist):
-    interesting_points = np.zeros(num_dist)
-    blockcenter = find_middle_position(wlist) 
-    for pos in wlist:
-        if(pos > 100 ):
-            interesting_points[det_dist_in_spec(blockcenter, pos)] = 1
-    
-    for i in range(0, 100):
-        interesting_points[i] = 0
-    
-
-    return interesting_points
+    return trace_data.labels_from_keys([wlist])[0].astype(np.float64)
 
 
 
@@ -169,15 +99,40 @@ def get_traces(trace_to_do, filename):
 
     keys, DS = read_trace_file(trace_to_do, filename)
 
-    labels = []
-    for k in keys:
-        labels.append(get_train_labels_from_key(k))
-    labels = np.array(labels)
+    labels = get_labels(keys)
 
     print("labels : ", keys[0])
     return DS, labels
 
 
+# get_train_labels_from_key for all keys at once (trace_data.labels_from_keys)
+def get_labels(keys):
+    return trace_data.labels_from_keys(keys)
+
+
+# streams the traces start:stop of a trace file in normalized batches, straight
+# from the memory-mapped companions, instead of loading them all up front
+def get_dataset(filename, labels, start, stop, batch_size=32, shuffle=False):
+
+    _, DS = trace_data.load_traces(filename)
+    cut = slice(start_cut, num_dist - end_cut)
+    length = num_dist - (start_cut + end_cut)
+
+    def batches():
+        order = np.arange(start, stop)
+        if shuffle:
+            np.random.shuffle(order)
+        for b in range(0, len(order), batch_size):
+            idx = np.sort(order[b:b + batch_size])
+            x = normalize_data(np.array(DS[idx, cut], dtype=np.float32))
+            y = labels[idx, cut].astype(np.float32)
+            yield x.reshape(len(idx), length, 1), y.reshape(len(idx), length, 1)
+
+    signature = (tf.TensorSpec(shape=(None, length, 1), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None, length, 1), dtype=tf.float32))
+    return tf.data.Dataset.from_generator(batches, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+
 def standardize(data):
     mean = np.mean(data)
     std = np.std(data)
@@ -188,10 +143,14 @@ def min_max_normalize(data):
     max_val = np.max(data)
     return (data - min_val) / (max_val - min_val)
 
+# min_max_normalize of every trace (first axis) at once, in place; works for
+# (n, length) and (n, length, 1) arrays. A constant trace becomes all zeros
 def normalize_data(data):
-    for i in range(len(data)):
-        data[i] = min_max_normalize(data[i])
-
+    axes = tuple(range(1, data.ndim))
+    min_val = np.min(data, axis=axes, keepdims=True)
+    span = np.max(data, axis=axes, keepdims=True) - min_val
+    data -= min_val
+    data /= np.where(span == 0, 1, span)
     return data
 
 
@@ -212,6 +171,54 @@ def print_Top_K_Evaluation(eval_pred, eval_truth, top_pred):
     return len(lowering_indices)- correctly_predicted_count
 
 
+# positions of the k highest predictions of every trace (n, k), highest first;
+# argpartition only sorts those k instead of the whole trace
+def top_k_positions(predictions, k):
+    top = np.argpartition(-predictions, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(predictions, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+# number of valleys each trace misses in its top K predictions, for several K at
+# once: (n, len(top_preds)). The top positions of the largest K give the rank
+# of every distance, blocks of traces bound the memory
+def top_k_missed(predictions, ground_truth, top_preds, block=1024):
+    predictions = np.asarray(predictions).reshape(len(predictions), -1)
+    ground_truth = np.asarray(ground_truth).reshape(len(ground_truth), -1) == 1
+    length = predictions.shape[1]
+    k_max = max(top_preds)
+    missed = np.zeros((len(predictions), len(top_preds)), dtype=np.int64)
+
+    for b in range(0, len(predictions), block):
+        pred = predictions[b:b + block]
+        truth = ground_truth[b:b + block]
+        top = top_k_positions(pred, k_max)
+        # rank 0 is the highest prediction, everything outside the top k_max ranks last
+        rank = np.full(pred.shape, length)
+        np.put_along_axis(rank, top, np.arange(k_max), axis=1)
+        for j, k in enumerate(top_preds):
+            missed[b:b + block, j] = (truth & (rank >= k)).sum(axis=1)
+    return missed
+
+
+# recall table of the test set: per K the traces that missed at most max_missed
+# valleys and the share of all valleys found
+def print_Top_K_Table(predictions, ground_truth, percents=(5, 10, 15, 20), max_missed=2):
+    ground_truth = np.asarray(ground_truth).reshape(len(ground_truth), -1)
+    length = ground_truth.shape[1]
+    top_preds = [round(length * p / 100) for p in percents]
+    missed = top_k_missed(predictions, ground_truth, top_preds)
+    num = len(ground_truth)
+    valleys = int((ground_truth == 1).sum())
+
+    print(f"{'top':>6} {'K':>6} {'traces':>16} {'valleys found':>16}")
+    for j, p in enumerate(percents):
+        hits = int((missed[:, j] <= max_missed).sum())
+        found = valleys - int(missed[:, j].sum())
+        print(f"{p:>5}% {top_preds[j]:>6} {hits:>7} / {num:<6} {found / max(valleys, 1):>16.3f}")
+    return missed
+
+
 def get_old_model(model_name):
     
     # Define custom_objects to include metric
@@ -230,89 +237,65 @@ def get_old_model(model_name):
     return loaded_model
 
 
-os.putenv("CUDA_VISIBLE_DEVICES", "0") #TODO: Choose GPU
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+def main():
 
+    os.putenv("CUDA_VISIBLE_DEVICES", "0") #TODO: Choose GPU
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 
-# TODO change for your file
-filename = './../test_key/test_trace.csv'
-use_old_model = 1
-num_samples = 1 
-num_test_samples = 1 
 
-trace_to_do = num_samples - num_test_samples
+    # TODO change for your file
+    filename = './../test_key/test_trace.csv'
+    use_old_model = 1
+    num_samples = 1 
+    num_test_samples = 1 
 
+    trace_to_do = num_samples - num_test_samples
 
-if(use_old_model):
-    #model_filename =  'pre_trained_models/2k.h5'
-    model_filename =  'pre_trained_models/10k.h5'
+    # computed once and cached next to the trace file
+    labels = trace_data.load_labels(filename, num_samples)
 
-    model = get_old_model(model_filename)
-else:
-    # train new model
 
-    DS, peaks = get_traces(trace_to_do, filename)
-    DS = normalize_data(DS)
+    if(use_old_model):
+        #model_filename =  'pre_trained_models/2k.h5'
+        model_filename =  'pre_trained_models/10k.h5'
 
-    X_train = DS[:, (0+start_cut):(num_dist-end_cut)].reshape(trace_to_do, num_dist - (start_cut + end_cut), 1)
-    y_train = peaks[:, (0+start_cut):(num_dist-end_cut)].reshape(trace_to_do, num_dist - (start_cut + end_cut), 1)
-
-    # Get model
-    model = get_fully_connected_model()
-
-    history = model.fit(X_train, y_train, epochs=24, batch_size=32, validation_split=0.1) 
-
-    # Save model with timestamp
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    #model_filename = f'model/my_model_{timestamp}.h5'
-    model_filename = f'cross_test/my_model_{timestamp}.h5'
-
-    model.save(model_filename)
-
-
-
-# Predict on real data
-DS, peaks = get_traces(num_samples, filename)
+        model = get_old_model(model_filename)
+    else:
+        # train new model, the last 10% of the traces validate
+        num_val = trace_to_do // 10
+        train = get_dataset(filename, labels, 0, trace_to_do - num_val, shuffle=True)
+        # too few traces to set any aside, train without validation
+        val = get_dataset(filename, labels, trace_to_do - num_val, trace_to_do) if num_val > 0 else None
 
-DS = DS[(num_samples-num_test_samples):num_samples]
-peaks = peaks[(num_samples-num_test_samples):num_samples]
+        # Get model
+        model = get_fully_connected_model()
 
-X_test = DS[:, (0+start_cut):(num_dist-end_cut)].reshape(num_test_samples, num_dist - (start_cut + end_cut), 1)
-y_test = peaks[:, (0+start_cut):(num_dist-end_cut)].reshape(num_test_samples, num_dist - (start_cut + end_cut), 1)
-num_dist -= (start_cut + end_cut)
-X_test = normalize_data(X_test)
+        history = model.fit(train, epochs=24, validation_data=val) 
 
+        # Save model with timestamp
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        #model_filename = f'model/my_model_{timestamp}.h5'
+        model_filename = f'cross_test/my_model_{timestamp}.h5'
 
-predictions = model.predict(X_test)
+        model.save(model_filename)
 
-# Reshape predictions 
-reshaped_predictions = predictions.reshape(num_test_samples, num_dist)
-reshaped_ground_truth = y_test.reshape(num_test_samples, num_dist)
 
 
-# Top-K Evaluation
-top = [0, 0, 0, 0]
+    # Predict on real data
+    test = get_dataset(filename, labels, num_samples - num_test_samples, num_samples)
+    predictions = model.predict(test)
 
-for i in range(num_test_samples):
-    eval_pred = reshaped_predictions[i]
-    eval_truth = reshaped_ground_truth[i]
-    # returns the number of missed positions
-    top5 = print_Top_K_Evaluation(eval_pred, eval_truth, round(num_dist*0.05))
-    top10 = print_Top_K_Evaluation(eval_pred, eval_truth, round(num_dist*0.10))
-    top15 = print_Top_K_Evaluation(eval_pred, eval_truth, round(num_dist*0.15))
-    top20 = print_Top_K_Evaluation(eval_pred, eval_truth, round(num_dist*0.20))
-    print()
+    length = num_dist - (start_cut + end_cut)
+    peaks = labels[(num_samples-num_test_samples):num_samples, start_cut:(num_dist-end_cut)]
 
-    # count if all but 2 positions have been found for different K percentiles
-    if(top5 <= 2): top[0] +=1
-    if(top10 <= 2): top[1] +=1
-    if(top15 <= 2): top[2] +=1
-    if(top20 <= 2): top[3] +=1
+    # Reshape predictions 
+    reshaped_predictions = predictions.reshape(num_test_samples, length)
+    reshaped_ground_truth = peaks.reshape(num_test_samples, length)
 
-print(f"top 5 : {top[0]} / {num_test_samples} -> {top[0]/num_test_samples}")
-print(f"top 10 : {top[1]} / {num_test_samples} -> {top[1]/num_test_samples}")
-print(f"top 15 : {top[2]} / {num_test_samples} -> {top[2]/num_test_samples}")
-print(f"top 20 : {top[3]} / {num_test_samples} -> {top[3]/num_test_samples}")
 
+    # Top-K Evaluation, a trace counts if all but 2 positions have been found
+    print_Top_K_Table(reshaped_predictions, reshaped_ground_truth, (5, 10, 15, 20), max_missed=2)
 
 
+if __name__ == '__main__':
+    main()
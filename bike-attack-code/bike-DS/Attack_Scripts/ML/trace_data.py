@@ -0,0 +1,135 @@
+"""
+Trace files of the CNN valley finder and their binary companions.
+
+A trace file (test_trace.csv, written by save_data in testing.ipynb) holds two
+lines per trace: the sorted weight list of the key, then the windowed
+distance spectrum. Parsing it is slow, so it is converted once into two .npy
+files next to it, which are memory-mapped afterwards:
+
+    <trace file>.keys.npy   int32   (n, weight)
+    <trace file>.ds.npy     float32 (n, num_dist)
+
+The conversion streams the file line by line and is redone when the trace
+file is newer than its companions (save_data appends to it). The training
+labels (1 at the valleys of each key) are computed for all keys at once and
+cached the same way:
+
+    <trace file>.labels.npy uint8   (n, num_dist)
+
+    import trace_data
+    keys, DS = trace_data.load_traces('./../test_key/test_trace.csv')
+    labels = trace_data.load_labels('./../test_key/test_trace.csv')
+"""
+import os
+import sys
+
+import numpy as np
+
+# dist_spec.py lives next to the collection scripts, one folder up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import dist_spec
+
+
+num_bits = 12323
+num_dist = (num_bits // 2) + 1
+
+
+def companion_paths(filename):
+    return filename + '.keys.npy', filename + '.ds.npy'
+
+
+def labels_path(filename):
+    return filename + '.labels.npy'
+
+
+def is_converted(filename):
+    """True if the companions exist and are not older than the trace file"""
+    mtime = os.path.getmtime(filename)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= mtime
+               for path in companion_paths(filename))
+
+
+def count_traces(filename):
+    """Number of complete traces (pairs of lines) in a trace file"""
+    lines = 0
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return lines // 2
+
+
+def parse_line(line, dtype):
+    # save_data ends every line with a separator
+    line = line.strip().rstrip(',')
+    if not line:
+        return np.zeros(0, dtype=dtype)
+    return np.array(line.split(','), dtype=dtype)
+
+
+def convert_trace_file(filename):
+    """Writes the .npy companions of a trace file"""
+    n = count_traces(filename)
+    with open(filename, 'r') as f:
+        weight = len(parse_line(f.readline(), np.int64)) if n else 0
+        length = len(parse_line(f.readline(), np.float64)) if n else num_dist
+
+    keys_path, ds_path = companion_paths(filename)
+    # written under temporary names, so a crash never leaves half a dataset behind
+    keys = np.lib.format.open_memmap(keys_path + '.tmp', mode='w+', dtype=np.int32, shape=(n, weight))
+    DS = np.lib.format.open_memmap(ds_path + '.tmp', mode='w+', dtype=np.float32, shape=(n, length))
+    with open(filename, 'r') as f:
+        for i in range(n):
+            key = parse_line(f.readline(), np.int64)
+            trace = parse_line(f.readline(), np.float64)
+            if len(key) != weight or len(trace) != length:
+                raise ValueError(f"trace {i} of {filename} has {len(key)} key positions and "
+                                 f"{len(trace)} distances, expected {weight} and {length}")
+            keys[i] = key
+            DS[i] = trace
+    keys.flush()
+    DS.flush()
+    del keys, DS
+    os.replace(keys_path + '.tmp', keys_path)
+    os.replace(ds_path + '.tmp', ds_path)
+
+
+def load_traces(filename, how_many=None):
+    """
+    Memory-mapped (keys, DS) of the first how_many traces (all if None) of a
+    trace file, converting it first if needed. The arrays are read-only.
+    """
+    if not is_converted(filename):
+        convert_trace_file(filename)
+    keys_path, ds_path = companion_paths(filename)
+    keys = np.load(keys_path, mmap_mode='r')
+    DS = np.load(ds_path, mmap_mode='r')
+    return keys[:how_many], DS[:how_many]
+
+
+def labels_from_keys(keys, ignore=100):
+    """
+    Labels (n, num_dist) of the weight lists keys (n, weight): 1 at the cyclic
+    distances between the block center and the positions, see
+    dist_spec.valley_labels.
+    """
+    return dist_spec.valley_labels(keys, num_bits, ignore=ignore)
+
+
+def load_labels(filename, how_many=None):
+    """
+    Memory-mapped labels of the first how_many traces of a trace file. They
+    are computed once and kept next to it until the keys change.
+    """
+    keys, _ = load_traces(filename)
+    path = labels_path(filename)
+    keys_path, _ = companion_paths(filename)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(keys_path):
+        labels = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8,
+                                           shape=(len(keys), num_dist))
+        # blocks of traces bound the temporary memory
+        for start in range(0, len(keys), 4096):
+            labels[start:start + 4096] = labels_from_keys(keys[start:start + 4096])
+        labels.flush()
+        del labels
+        os.replace(path + '.tmp', path)
+    return np.load(path, mmap_mode='r')[:how_many]
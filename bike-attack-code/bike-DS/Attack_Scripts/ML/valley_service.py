@@ -0,0 +1,227 @@
+"""
+Keeps a trained valley finder model loaded and ranks the candidate distances of
+distance spectra, from Python or through a local socket.
+
+    python valley_service.py pre_trained_models/10k.h5 --tflite --socket /tmp/valleys.sock
+
+    import valley_service
+    finder = valley_service.ValleyFinder('pre_trained_models/10k.h5', tflite=True)
+    candidates = finder.rank(DS, top=0.2)
+
+The model is loaded once, so spectra that a long collection emits bit by bit
+only pay for the prediction. With --tflite the Keras model is converted into
+a TensorFlow Lite model, which runs on the CPU with the XNNPACK delegate
+(the default of the TF Lite interpreter). The conversion is cached next to
+the model as <model>.tflite; tflite_runtime is used instead of TensorFlow
+when only that is installed and the cached conversion exists.
+
+Spectra are (n, num_dist) arrays like the DS of a trace file (or a single
+spectrum), normalized as in CNN_DS_finder.py. rank returns (n, k) candidate
+distances, the most likely valley first.
+
+Socket protocol: the client sends the spectra as one .npy array (np.save)
+and receives the candidates as one .npy array, any number of times per
+connection. Requests are answered one after the other. See rank_remote.
+"""
+import argparse
+import io
+import os
+import socket
+import socketserver
+
+import numpy as np
+
+
+num_bits = 12323
+num_dist = (num_bits // 2) + 1
+
+
+def tflite_path(model_path):
+    return model_path + '.tflite'
+
+
+def load_interpreter(model_path, threads=None):
+    """TF Lite interpreter of a Keras model, converting it first if needed"""
+    path = tflite_path(model_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path):
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path, compile=False)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+        os.replace(path + '.tmp', path)
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=threads)
+
+
+class ValleyFinder(object):
+    """A loaded valley finder model"""
+
+    def __init__(self, model_path, tflite=False, threads=None, start_cut=0, end_cut=0):
+        self.start_cut = start_cut
+        self.end_cut = end_cut
+        self.length = num_dist - (start_cut + end_cut)
+        self.model = None
+        self.interpreter = None
+        if tflite:
+            self.interpreter = load_interpreter(model_path, threads)
+            self.input_index = self.interpreter.get_input_details()[0]['index']
+            self.output_index = self.interpreter.get_output_details()[0]['index']
+            self.batch = None
+        else:
+            import tensorflow as tf
+            if threads:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+            self.model = tf.keras.models.load_model(model_path, compile=False)
+
+    def prepare(self, spectra):
+        """Cut and normalized (n, length, 1) float32 model input"""
+        spectra = np.atleast_2d(np.asarray(spectra))
+        if spectra.ndim != 2 or spectra.shape[1] != num_dist:
+            raise ValueError(f"expected spectra of {num_dist} distances, got shape {spectra.shape}")
+        x = np.array(spectra[:, self.start_cut:num_dist - self.end_cut], dtype=np.float32)
+        # min-max normalization per spectrum, as normalize_data in CNN_DS_finder.py;
+        # a constant spectrum becomes all zeros
+        x -= x.min(axis=1, keepdims=True)
+        max_val = x.max(axis=1, keepdims=True)
+        x /= np.where(max_val == 0, 1, max_val)
+        return x.reshape(len(x), self.length, 1)
+
+    def _invoke(self, x):
+        # the interpreter is only resized when the batch size changes
+        if self.batch != len(x):
+            self.interpreter.resize_tensor_input(self.input_index, x.shape)
+            self.interpreter.allocate_tensors()
+            self.batch = len(x)
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, spectra):
+        """Valley probability per distance (n, length)"""
+        x = self.prepare(spectra)
+        if self.interpreter is not None:
+            y = self._invoke(x)
+        else:
+            y = self.model.predict_on_batch(x)
+        return np.asarray(y).reshape(len(x), self.length)
+
+    def rank(self, spectra, top=0.2):
+        """
+        The top (fraction of the distances, or number if >= 1) candidate
+        distances of every spectrum (n, k), the most likely valley first.
+        """
+        predictions = self.predict(spectra)
+        k = int(top) if top >= 1 else round(self.length * top)
+        k = min(max(k, 1), self.length)
+        # top_k_positions of CNN_DS_finder.py, which would import TensorFlow
+        top_pos = np.argpartition(-predictions, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(predictions, top_pos, axis=1), axis=1)
+        return np.take_along_axis(top_pos, order, axis=1) + self.start_cut
+
+
+def read_npy(f):
+    """One .npy array from a stream; np.load needs a seekable file"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        raise ValueError(f"unsupported .npy version {version}")
+    if dtype.hasobject:
+        raise ValueError("object arrays are not accepted")
+    size = int(np.prod(shape)) * dtype.itemsize
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError(f"expected {size} bytes of array data, got {len(data)}")
+    return np.frombuffer(data, dtype=dtype).reshape(shape, order='F' if fortran_order else 'C')
+
+
+def write_npy(f, array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    f.write(buffer.getvalue())
+    f.flush()
+
+
+class RankHandler(socketserver.StreamRequestHandler):
+    """Answers every .npy array of spectra with the array of their candidates"""
+
+    def handle(self):
+        while self.rfile.peek(1):
+            try:
+                spectra = read_npy(self.rfile)
+                candidates = self.server.finder.rank(spectra, self.server.top)
+            except ValueError as e:
+                print(f"invalid request: {e}", flush=True)
+                return
+            write_npy(self.wfile, candidates.astype(np.int32))
+
+
+class UnixServer(socketserver.UnixStreamServer):
+    pass
+
+
+class TCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def serve(finder, address, top=0.2):
+    """Serves rank requests on a unix socket (path) or a TCP (host, port) until interrupted"""
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixServer(address, RankHandler)
+    else:
+        server = TCPServer(address, RankHandler)
+    server.finder = finder
+    server.top = top
+    print(f"serving valley candidates on {address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+
+
+def rank_remote(spectra, address):
+    """Client side of serve: the candidates of spectra from a running service"""
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        with sock.makefile('rwb') as f:
+            write_npy(f, np.atleast_2d(np.asarray(spectra)))
+            return read_npy(f)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Serve the candidate distances of a valley finder model",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    parser.add_argument("model", help="Keras model, e.g., pre_trained_models/10k.h5")
+    parser.add_argument("--tflite", action="store_true", help="Run the model with TensorFlow Lite")
+    parser.add_argument("--threads", type=int, help="CPU threads of the model")
+    parser.add_argument("--top", type=float, default=0.2,
+                        help="Candidates per spectrum, fraction of the distances or number (default 0.2)")
+    parser.add_argument("--socket", default="/tmp/valley_service.sock", help="Unix socket to listen on")
+    parser.add_argument("--port", type=int, help="Listen on this localhost TCP port instead")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    finder = ValleyFinder(args.model, tflite=args.tflite, threads=args.threads)
+    address = ("127.0.0.1", args.port) if args.port is not None else args.socket
+    serve(finder, address, args.top)
+
+
+if __name__ == '__main__':
+    main()
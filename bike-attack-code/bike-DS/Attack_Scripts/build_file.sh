@@ -30,13 +30,13 @@ if [ "$2" == "-noparallel" ]; then
     gcc -c -o $patterns_path/patterns.o $patterns_path/patterns.c -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lm -lbike
 
     # Link patterns.o with test.c
-    gcc -o ${filename%.*}.out $c_file $patterns_path/patterns.o -I$patterns_path -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lbike -lm
+    gcc -o ${filename%.*}.out $c_file $patterns_path/patterns.o -I$patterns_path -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lbike -lm -pthread
 else
     # Compile patterns.c into patterns.o with OpenMP
     gcc -c -o $patterns_path/patterns.o $patterns_path/patterns.c -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lm -lbike -fopenmp
 
     # Link patterns.o with test.c and OpenMP
-    gcc -o ${filename%.*}.out $c_file $patterns_path/patterns.o -I$patterns_path -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lbike -fopenmp -lm
+    gcc -o ${filename%.*}.out $c_file $patterns_path/patterns.o -I$patterns_path -I./../bike_Modified_CodeBase/include/internal/ -I./../bike_Modified_CodeBase/include/ -L./../bike_Modified_CodeBase/build/ -lbike -fopenmp -lm -pthread
 fi
 
 # Check if compilation was successful
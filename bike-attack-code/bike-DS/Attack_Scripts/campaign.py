@@ -0,0 +1,228 @@
+"""
+Splits a collection over several test.out processes and merges the results.
+
+    python campaign.py run test_key --cycles 9000000 --shards 8 --change_e 4
+    python campaign.py status test_key
+    python campaign.py merge test_key
+
+Every shard k runs in its own folder <folder>/shards/shard_<k> (with a copy of
+key.txt) with --binary and the seed --seed + k, and writes its own data.bin.
+The shard settings are kept in shard.json next to it, so several hosts that
+share the folder can each run a part of the shards (--only 0,1,2,3 on one
+host, --only 4,5,6,7 on another) and any of them can report the status or
+merge. A shard that was interrupted continues with the missing cycles and a
+new seed when run again; finished shards are skipped.
+
+merge concatenates the complete chunks of all shards into <folder>/data.bin,
+which testing.ipynb, dist_aggregate.py and early_stop.py read.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import dist_aggregate
+import dist_data
+
+
+def shard_folder(folder, k):
+    return os.path.join(folder, "shards", f"shard_{k}")
+
+
+def shard_folders(folder):
+    """The shard folders of a campaign, ordered by shard number"""
+    root = os.path.join(folder, "shards")
+    if not os.path.isdir(root):
+        return []
+    names = [n for n in os.listdir(root) if n.startswith("shard_")]
+    return [os.path.join(root, n) for n in sorted(names, key=lambda n: int(n[6:]))]
+
+
+def read_settings(path):
+    with open(os.path.join(path, "shard.json"), "r") as f:
+        return json.load(f)
+
+
+def cycles_done(path):
+    data_path = os.path.join(path, "data.bin")
+    if not os.path.exists(data_path):
+        return 0, 0
+    chunks = dist_data.read_binary(data_path)
+    return int(chunks['chunk_size'].sum(dtype=np.int64)), len(chunks)
+
+
+def drop_partial_record(path):
+    """
+    Cuts a partially written last record (test.out killed in the middle of a
+    write) off the data.bin of a shard, so the records of the next run are
+    appended in line with the complete ones.
+    """
+    data_path = os.path.join(path, "data.bin")
+    if not os.path.exists(data_path):
+        return
+    header = dist_data.read_header(data_path)
+    if header is None:
+        size = 0
+    else:
+        size = len(dist_data.read_binary(data_path)) * dist_data.chunk_dtype(int(header['spec_len'])).itemsize
+    if os.path.getsize(data_path) > size:
+        os.truncate(data_path, size)
+
+
+def prepare_shards(args):
+    """Writes the folder and shard.json of every shard, returns their folders"""
+    per_shard = [args.cycles // args.shards + (k < args.cycles % args.shards)
+                 for k in range(args.shards)]
+    paths = []
+    for k in range(args.shards):
+        path = shard_folder(args.folder, k)
+        os.makedirs(path, exist_ok=True)
+        shutil.copyfile(os.path.join(args.folder, "key.txt"), os.path.join(path, "key.txt"))
+        settings = {"shard": k, "cycles": per_shard[k], "seed": args.seed + k,
+                    "change_e": args.change_e}
+        if os.path.exists(os.path.join(path, "shard.json")) and read_settings(path) != settings:
+            sys.exit(f"{path} was started with other settings, see its shard.json")
+        with open(os.path.join(path, "shard.json"), "w") as f:
+            json.dump(settings, f)
+        paths.append(path)
+    return paths
+
+
+def start_shard(args, path):
+    """Starts test.out for the missing cycles of a shard, None if it is done"""
+    settings = read_settings(path)
+    drop_partial_record(path)
+    done, chunks = cycles_done(path)
+    missing = settings["cycles"] - done
+    if missing <= 0:
+        return None
+    # a resumed shard must not repeat the error vectors of its first attempts
+    seed = settings["seed"] + args.shards * chunks
+    command = [os.path.abspath(args.test_out), ".", "--binary", "--cycles", str(missing),
+               "--threads", str(args.threads), "--seed", str(seed)]
+    if settings["change_e"] is not None:
+        command += ["--change_e", str(settings["change_e"])]
+    with open(os.path.join(path, "test_out.log"), "a") as log:
+        return subprocess.Popen(command, cwd=path, stdout=log, stderr=subprocess.STDOUT)
+
+
+def print_status(folder):
+    total = target = 0
+    for path in shard_folders(folder):
+        settings = read_settings(path)
+        done, chunks = cycles_done(path)
+        total += done
+        target += settings["cycles"]
+        print(f"shard {settings['shard']:>3}: {done:>10} / {settings['cycles']} cycles in {chunks} chunks")
+    if target:
+        print(f"total    : {total:>10} / {target} cycles ({100 * total / target:.1f}%)")
+    return total, target
+
+
+def run(args):
+    paths = prepare_shards(args)
+    selected = range(args.shards) if args.only is None else args.only
+    pending = [paths[k] for k in selected]
+    running = {}
+    aggregators = {path: dist_aggregate.Aggregator(os.path.join(path, "data.bin")) for path in pending}
+    failed = []
+
+    while pending or running:
+        while pending and len(running) < args.jobs:
+            path = pending.pop(0)
+            proc = start_shard(args, path)
+            if proc is not None:
+                running[path] = proc
+        time.sleep(args.interval if running else 0)
+        for path, proc in list(running.items()):
+            if proc.poll() is not None:
+                del running[path]
+                if proc.returncode != 0:
+                    failed.append(path)
+        for agg in aggregators.values():
+            agg.update()
+        done = sum(agg.cycles for agg in aggregators.values())
+        target = sum(read_settings(path)["cycles"] for path in aggregators)
+        print(f"{done} / {target} cycles, {len(running)} shards running", flush=True)
+
+    for path in failed:
+        print(f"test.out failed in {path}, see its test_out.log")
+    if failed:
+        sys.exit(1)
+
+
+def merge(args):
+    out = args.output or os.path.join(args.folder, "data.bin")
+    if os.path.exists(out):
+        sys.exit(f"{out} exists, remove it or choose another file with -o")
+    spec_len = None
+    with open(out, "wb") as f:
+        for path in shard_folders(args.folder):
+            if not os.path.exists(os.path.join(path, "data.bin")):
+                continue
+            chunks = dist_data.read_binary(os.path.join(path, "data.bin"))
+            if len(chunks) == 0:
+                continue
+            if spec_len is not None and chunks.dtype != dist_data.chunk_dtype(spec_len):
+                sys.exit(f"{path} has spectra of another length")
+            spec_len = int(chunks['spec_len'][0])
+            f.write(chunks.tobytes())
+    succ, cycles = dist_data.totals(dist_data.read_binary(out))[:2]
+    print(f"merged {cycles} cycles ({cycles - succ} failures) into {out}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Run a distance spectrum collection as several test.out shards",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Start or continue the shards")
+    run_parser.add_argument("folder", help="Folder with key.txt")
+    run_parser.add_argument("--cycles", type=int, required=True, help="Decryptions of all shards together")
+    run_parser.add_argument("--shards", type=int, default=os.cpu_count(),
+                            help="Number of shards (default: one per core)")
+    run_parser.add_argument("--only", type=lambda s: [int(k) for k in s.split(",")],
+                            help="Run only these shards, e.g., 0,1,2,3")
+    run_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="Concurrent test.out processes (default: one per core)")
+    run_parser.add_argument("--threads", type=int, default=1,
+                            help="OpenMP threads of each test.out (default 1)")
+    run_parser.add_argument("--seed", type=int, default=1, help="Seed of shard 0 (default 1)")
+    run_parser.add_argument("--change_e", type=int, help="Passed on to test.out")
+    run_parser.add_argument("--interval", type=float, default=30,
+                            help="Seconds between progress reports (default 30)")
+    run_parser.add_argument("--test-out", default="./test.out", help="Path of test.out")
+
+    status_parser = commands.add_parser("status", help="Show the progress of the shards")
+    status_parser.add_argument("folder")
+
+    merge_parser = commands.add_parser("merge", help="Merge the shards into one data.bin")
+    merge_parser.add_argument("folder")
+    merge_parser.add_argument("-o", "--output", help="Merged file (default <folder>/data.bin)")
+    args = parser.parse_args()
+    if args.command == "run" and args.only is not None:
+        invalid = [k for k in args.only if not 0 <= k < args.shards]
+        if invalid:
+            run_parser.error(f"--only {','.join(map(str, invalid))}: there are only shards 0 to {args.shards - 1}")
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.command == "run":
+        run(args)
+    elif args.command == "status":
+        print_status(args.folder)
+    else:
+        merge(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,9 @@
 #include <sys/time.h>
 #include <sys/stat.h>
 #include <dirent.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <stdatomic.h>
 // #include "types.h"
 
 //#include "patterns.h"
@@ -36,6 +39,7 @@
 
 char key_file_name[file_name_length] = "key.txt";
 char data_file_name[file_name_length] = "data.txt";
+char data_bin_file_name[file_name_length] = "data.bin";
 int percent_to_print = 10;
 char folder_to_safe[file_name_length] = "Enc_data";
 
@@ -244,6 +248,22 @@ int read_faulty_keys(unsigned char ***sk_list, unsigned char ***pk_list, int *am
 
 
 
+// non-interactive settings from the command line (--cycles / --threads),
+// -1 asks on the terminal
+int cycles_arg = -1;
+int threads_arg = -1;
+
+// the collection stops after the current chunks once this file exists (--stop-file)
+char stop_file[file_name_length] = "";
+
+// set by the dist spec writer thread when the data file cannot be written
+atomic_int dist_spec_write_failed = 0;
+
+int stop_requested(){
+  if (atomic_load(&dist_spec_write_failed)) return 1;
+  return stop_file[0] != '\0' && access(stop_file, F_OK) == 0;
+}
+
 void readNumberFromTerminal(int *x) {
     printf("Enter a number: ");
     scanf("%d", x);
@@ -271,38 +291,89 @@ void set_change_e(int length_e){
   num_of_fixed_positions = length_e;
 }
 
-void save_dist_spec(char* fileName, int** dist_spec, int** dist_spec_sum, int succ){
-  
-  char file_path[file_name_length]; 
-  get_file_path(file_path, fileName, data_file_name);
-  FILE *file = fopen(file_path, "a");
-  if (file != NULL){
+// binary chunk format (--binary): "data.bin" holds one fixed-size record per
+// saved chunk, every field is a little-endian int32
+//   header: magic "BKDS", version, level, r_bits, spec_len, chunk_size, succ, reserved
+//   then dist_spec[0], dist_spec_sum[0], dist_spec[1], dist_spec_sum[1] with spec_len entries each
+// see dist_data.py for the reader
+#define DIST_SPEC_MAGIC "BKDS"
+#define DIST_SPEC_VERSION 1
+#define DIST_SPEC_HEADER_LEN 8
+#define DIST_SPEC_RECORD_LEN (DIST_SPEC_HEADER_LEN + 4 * DIST_SPEC_LEN)
+int save_binary = 0;
+
+void set_save_binary(){
+  save_binary = 1;
+}
+
+static void put_le32(uint8_t *out, int32_t value){
+  uint32_t v = (uint32_t)value;
+  out[0] = v & 0xff;
+  out[1] = (v >> 8) & 0xff;
+  out[2] = (v >> 16) & 0xff;
+  out[3] = (v >> 24) & 0xff;
+}
 
-      fprintf(file, "%d,%d\n", succ, amount_when_saved);
+// returns 0 if the whole record was written
+int write_dist_spec_binary(FILE *file, int** dist_spec, int** dist_spec_sum, int succ, int chunk_size){
+
+  // only the writer thread saves records, so one buffer is enough
+  static uint8_t record[DIST_SPEC_RECORD_LEN * 4];
+  uint8_t *pos = record + 4;
+  int32_t header[DIST_SPEC_HEADER_LEN - 1] = {DIST_SPEC_VERSION, LEVEL, R_BITS, DIST_SPEC_LEN, chunk_size, succ, 0};
+
+  memcpy(record, DIST_SPEC_MAGIC, 4);
+  for (int i = 0; i < DIST_SPEC_HEADER_LEN - 1; i++, pos += 4)
+    put_le32(pos, header[i]);
+  for (int y = 0; y < 2; y++){
+    for (int i = 0; i < DIST_SPEC_LEN; i++, pos += 4)
+      put_le32(pos, dist_spec[y][i]);
+    for (int i = 0; i < DIST_SPEC_LEN; i++, pos += 4)
+      put_le32(pos, dist_spec_sum[y][i]);
+  }
 
-      for (int i = 0; i < DIST_SPEC_LEN; i++)
-        fprintf(file, "%d,", dist_spec[0][i]);
-      fprintf(file, "\n");
-      for (int i = 0; i < DIST_SPEC_LEN; i++)
-        fprintf(file, "%d,", dist_spec_sum[0][i]);
-      fprintf(file, "\n");
+  // one write per record, so readers only ever see whole records or a truncated last one
+  return fwrite(record, DIST_SPEC_RECORD_LEN * 4, 1, file) == 1 ? 0 : -1;
+}
 
+// returns 0 on success, -1 if the chunk could not be written
+int write_dist_spec(FILE *file, int** dist_spec, int** dist_spec_sum, int succ, int chunk_size){
 
-      for (int i = 0; i < DIST_SPEC_LEN; i++)
-        fprintf(file, "%d,", dist_spec[1][i]);
-      fprintf(file, "\n");
-      for (int i = 0; i < DIST_SPEC_LEN; i++)
-        fprintf(file, "%d,", dist_spec_sum[1][i]);
-      fprintf(file, "\n");;
+  if(save_binary)
+    return write_dist_spec_binary(file, dist_spec, dist_spec_sum, succ, chunk_size);
 
-      
-      fflush(file);
-      fclose(file); 
-    
-  }
-  else printf("Error opening the file.\n");
+  fprintf(file, "%d,%d\n", succ, chunk_size);
+
+  for (int i = 0; i < DIST_SPEC_LEN; i++)
+    fprintf(file, "%d,", dist_spec[0][i]);
+  fprintf(file, "\n");
+  for (int i = 0; i < DIST_SPEC_LEN; i++)
+    fprintf(file, "%d,", dist_spec_sum[0][i]);
+  fprintf(file, "\n");
+
+
+  for (int i = 0; i < DIST_SPEC_LEN; i++)
+    fprintf(file, "%d,", dist_spec[1][i]);
+  fprintf(file, "\n");
+  for (int i = 0; i < DIST_SPEC_LEN; i++)
+    fprintf(file, "%d,", dist_spec_sum[1][i]);
+  fprintf(file, "\n");
+  return ferror(file) ? -1 : 0;
 }
 
+// "data.txt" or "data.bin" in the folder, opened for appending
+FILE *open_dist_spec_file(char* fileName){
+
+  char file_path[file_name_length];
+  get_file_path(file_path, fileName, save_binary ? data_bin_file_name : data_file_name);
+  FILE *file = fopen(file_path, save_binary ? "ab" : "a");
+  if (file == NULL)
+    printf("Error opening the file.\n");
+  return file;
+}
+
+
+
 void save_enc_data(char *fileName, struct Meta_Info_enc* info, int rounds){
 
   FILE *file = fopen(fileName, "a");
@@ -352,7 +423,11 @@ void get_w_list(OUT int* out_arr, OUT int* arr_len, IN unsigned char* e){
   *arr_len = pos;
 }
 
-void update_dist_spec(int* dist_spec, int* dist_spec_sum, unsigned char* e, int succ){
+// dist_seen[dist] == generation marks the distances already counted in this
+// call, so the array only has to be zeroed once: pass a new generation (> 0)
+// for every call
+void update_dist_spec(int* dist_spec, int* dist_spec_sum, unsigned char* e, int succ,
+                      unsigned int* dist_seen, unsigned int generation){
   
   // fix length for bike
   int w_list_e[200];
@@ -363,23 +438,21 @@ void update_dist_spec(int* dist_spec, int* dist_spec_sum, unsigned char* e, int
   }
 
 
-
-  int cur_dist_seen[DIST_SPEC_LEN] = {0};
+  int l = succ ? 0 : 1;
   for (size_t i = 0; i < w_list_len; i++){
     for (size_t j = i+1; j < w_list_len; j++){
      
       int a = w_list_e[i];
       int b = w_list_e[j];
-      int l = succ ? 0 : 1;
       
       int dist;
       if(b-a > DIST_SPEC_MAX_DIST) dist = R_BITS - (b-a);
       else dist = (b-a);
 
-      if( !cur_dist_seen[dist]){
+      if(dist_seen[dist] != generation){
         dist_spec[dist] += l;
         dist_spec_sum[dist] += 1;
-        cur_dist_seen[dist] = 1;
+        dist_seen[dist] = generation;
       }
       if(dist < 0 ){
         exit(0);
@@ -395,6 +468,140 @@ void update_dist_spec(int* dist_spec, int* dist_spec_sum, unsigned char* e, int
 
 
 
+// >>>>>>>>>>>>>>>>>>>>>>><<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+// >>>>>>>>>>>>>>>> Dist spec writer thread <<<<<<<<<<<<<<<<<
+// >>>>>>>>>>>>>>>>>>>>>>><<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+
+// Every worker counts into its own dist spec buffers. When a chunk is done it
+// swaps them with the back buffers of its slot and sets 'full'; the writer
+// thread appends the back buffers to the data file, clears them and resets
+// 'full'. A worker only waits if the writer has not saved its previous chunk
+// yet, there are no locks between the workers.
+struct dist_spec_slot {
+  int *dist_spec[2];
+  int *dist_spec_sum[2];
+  int succ;
+  int chunk_size;
+  atomic_int full;
+};
+
+struct dist_spec_writer {
+  pthread_t thread;
+  struct dist_spec_slot *slots;
+  int num_slots;
+  char *folder_name;
+  atomic_int done;
+};
+
+void clear_dist_spec(int** dist_spec, int** dist_spec_sum){
+  for (size_t y = 0; y < 2; y++){
+    memset(dist_spec[y], 0, DIST_SPEC_LEN * sizeof(int));
+    memset(dist_spec_sum[y], 0, DIST_SPEC_LEN * sizeof(int));
+  }
+}
+
+void *run_dist_spec_writer(void *arg){
+
+  struct dist_spec_writer *writer = arg;
+  FILE *file = open_dist_spec_file(writer->folder_name);
+  if (file == NULL)
+    atomic_store(&dist_spec_write_failed, 1);
+
+  while (1){
+    // read 'done' before the slots: chunks handed over before it was set are seen below
+    int done = atomic_load_explicit(&writer->done, memory_order_acquire);
+    int written = 0;
+
+    for (int i = 0; i < writer->num_slots; i++){
+      struct dist_spec_slot *slot = &writer->slots[i];
+      if (!atomic_load_explicit(&slot->full, memory_order_acquire))
+        continue;
+
+      // after a failed write the chunks are dropped, the workers stop (stop_requested)
+      if (file != NULL && write_dist_spec(file, slot->dist_spec, slot->dist_spec_sum, slot->succ, slot->chunk_size) != 0){
+        perror("Error writing the dist spec");
+        atomic_store(&dist_spec_write_failed, 1);
+        fclose(file);
+        file = NULL;
+      }
+      clear_dist_spec(slot->dist_spec, slot->dist_spec_sum);
+      atomic_store_explicit(&slot->full, 0, memory_order_release);
+      written++;
+    }
+
+    if (written){
+      if (file != NULL && fflush(file) != 0){
+        perror("Error writing the dist spec");
+        atomic_store(&dist_spec_write_failed, 1);
+        fclose(file);
+        file = NULL;
+      }
+    }
+    else if (done) break;
+    else usleep(1000);
+  }
+
+  if (file != NULL) fclose(file);
+  return NULL;
+}
+
+void start_dist_spec_writer(struct dist_spec_writer *writer, int num_slots, char* folderName){
+
+  writer->num_slots = num_slots;
+  writer->folder_name = folderName;
+  writer->slots = calloc(num_slots, sizeof(struct dist_spec_slot));
+  for (int i = 0; i < num_slots; i++){
+    for (size_t y = 0; y < 2; y++){
+      writer->slots[i].dist_spec[y] = calloc(DIST_SPEC_LEN, sizeof(int));
+      writer->slots[i].dist_spec_sum[y] = calloc(DIST_SPEC_LEN, sizeof(int));
+    }
+    atomic_init(&writer->slots[i].full, 0);
+  }
+  atomic_init(&writer->done, 0);
+  pthread_create(&writer->thread, NULL, run_dist_spec_writer, writer);
+}
+
+// saves all handed over chunks and frees the slots
+void stop_dist_spec_writer(struct dist_spec_writer *writer){
+
+  atomic_store_explicit(&writer->done, 1, memory_order_release);
+  pthread_join(writer->thread, NULL);
+
+  for (int i = 0; i < writer->num_slots; i++){
+    for (size_t y = 0; y < 2; y++){
+      free(writer->slots[i].dist_spec[y]);
+      free(writer->slots[i].dist_spec_sum[y]);
+    }
+  }
+  free(writer->slots);
+}
+
+// hands the finished chunk in dist_spec / dist_spec_sum to the writer and
+// returns cleared buffers in them
+void hand_over_dist_spec(struct dist_spec_slot *slot, int** dist_spec, int** dist_spec_sum, int succ, int chunk_size){
+
+  while (atomic_load_explicit(&slot->full, memory_order_acquire))
+    usleep(100);
+
+  for (size_t y = 0; y < 2; y++){
+    int *tmp = slot->dist_spec[y];
+    slot->dist_spec[y] = dist_spec[y];
+    dist_spec[y] = tmp;
+
+    tmp = slot->dist_spec_sum[y];
+    slot->dist_spec_sum[y] = dist_spec_sum[y];
+    dist_spec_sum[y] = tmp;
+  }
+  slot->succ = succ;
+  slot->chunk_size = chunk_size;
+  atomic_store_explicit(&slot->full, 1, memory_order_release);
+}
+
+
+
+
+
+
 // >>>>>>>>>>>>>>>>>>>>>>><<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 // >>>>>>>>> BIKE Key encaps and decaps apis <<<<<<<<<<<<<<<<
 // >>>>>>>>>>>>>>>>>>>>>>><<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
@@ -477,6 +684,9 @@ int enc_dec_dist_spec(
   int count_succ = 0;
   int percent = 0;
 
+  unsigned int *dist_seen = calloc(DIST_SPEC_LEN, sizeof(unsigned int));
+  unsigned int generation = 0;
+
   // start time tracking
   struct timeval start_time, end_time;
   gettimeofday(&start_time, NULL);
@@ -513,8 +723,8 @@ int enc_dec_dist_spec(
       count_succ++;
     }
     
-    update_dist_spec(dist_spec[0], dist_spec_sum[0], e_out_enc[0], succ);
-    update_dist_spec(dist_spec[1], dist_spec_sum[1], e_out_enc[1], succ);
+    update_dist_spec(dist_spec[0], dist_spec_sum[0], e_out_enc[0], succ, dist_seen, ++generation);
+    update_dist_spec(dist_spec[1], dist_spec_sum[1], e_out_enc[1], succ, dist_seen, ++generation);
 
     // print status
     if (do_print)
@@ -541,12 +751,14 @@ int enc_dec_dist_spec(
   free(ss_enc);
   free(ss_dec);
   free(out);
+  free(dist_seen);
   return count_succ;
 }
 
 
 // simple enc dec clycle times and returns the number of successes but in parallel
-// automatically saves the distance spectrum after 'amount_when_saved' cycles into "data.txt" into the folder !Appends!
+// automatically saves the distance spectrum after 'amount_when_saved' cycles into "data.txt" (or "data.bin" with --binary) into the folder !Appends!
+// the chunks are saved by a writer thread while the workers continue
 int par_enc_dec_dist_spec(
     IN int cycles,
     IN unsigned char *pk,
@@ -555,6 +767,7 @@ int par_enc_dec_dist_spec(
 {
   printf("   >> enc and dec for %d rounds \n", cycles);
   int count_succ = 0;
+  int cycles_run = 0;
 
   struct timeval start_time, end_time, start_time_int, end_time_int ;
   gettimeofday(&start_time, NULL);
@@ -569,8 +782,12 @@ int par_enc_dec_dist_spec(
   printf("Save every %d samples \n", amount_when_saved);
   printf("Cycles to do %d \n", cycles / num_threads);
 
+  // one slot per worker, the writer thread saves the handed over chunks
+  struct dist_spec_writer writer;
+  start_dist_spec_writer(&writer, num_threads, folderName);
+
 // run the enc_dec() in even : cycle/num_threads chunks and collect all succ
-  #pragma omp parallel for reduction(+ : count_succ)
+  #pragma omp parallel for reduction(+ : count_succ, cycles_run)
   for (int i = 0; i < num_threads; i++)
   {
     int cycles_tmp;
@@ -633,24 +850,15 @@ int par_enc_dec_dist_spec(
 
        int succ_cur = enc_dec_dist_spec(0, cur_cycles, NULL, dist_spec, dist_spec_sum, pk_tmp, sk_tmp);
        count_succ += succ_cur;
+       cycles_run += cur_cycles;
         
 
 
-      #pragma omp critical
-      {
-        save_dist_spec(folderName, dist_spec, dist_spec_sum, succ_cur);
-      }
+      // continues with cleared buffers, the writer saves this chunk
+      hand_over_dist_spec(&writer.slots[i], dist_spec, dist_spec_sum, succ_cur, cur_cycles);
       
       if(cycles_to_do == 0)break;
-      
-
-    
-      // reset your dist spec data to zero
-      for (size_t y = 0; y < 2; y++){
-      // Set all elements to zero
-        memset(dist_spec[y], 0, DIST_SPEC_LEN * sizeof(int));
-        memset(dist_spec_sum[y], 0, DIST_SPEC_LEN * sizeof(int));
-      }
+      if(stop_requested())break;
     }
 
     free(pk_tmp);
@@ -663,21 +871,33 @@ int par_enc_dec_dist_spec(
     free(dist_spec_sum);
 
     }
+
+  stop_dist_spec_writer(&writer);
   
 gettimeofday(&end_time, NULL);  
 double elapsed_time = (end_time.tv_sec - start_time.tv_sec) + (double)(end_time.tv_usec - start_time.tv_usec) / 1000000.0;
 printf("time %.2f seconds\n", elapsed_time);
 
+  if(atomic_load(&dist_spec_write_failed))
+    printf("stopped after %d of %d cycles, the chunks could not be saved\n", cycles_run, cycles);
+  else if(cycles_run < cycles)
+    printf("stopped by %s after %d of %d cycles\n", stop_file, cycles_run, cycles);
 
   printf("\n");
   printf("------------------------------------\n");
   printf("---ALL------------------------------\n");
   printf("---- Successes  / Failures ---------\n");
-  printf("----       %d   / %d       ---------\n", count_succ, cycles - count_succ);
-  printf("----       %f   / %f       ---------\n", (double)count_succ / cycles * 100, ((double)cycles - count_succ) / cycles * 100);
+  printf("----       %d   / %d       ---------\n", count_succ, cycles_run - count_succ);
+  // no percentages if the stop file was there before the first chunk
+  if(cycles_run > 0)
+    printf("----       %f   / %f       ---------\n", (double)count_succ / cycles_run * 100, ((double)cycles_run - count_succ) / cycles_run * 100);
   printf("------------------------------------\n");
   printf("\n");
 
+  // the data file misses chunks, do not report success to the caller
+  if(atomic_load(&dist_spec_write_failed))
+    exit(1);
+
   return count_succ;
 }
 
@@ -773,13 +993,17 @@ int collect_dist_for_key(const char *folder_name){
     //exit_program();
   }
 
-  printf("||||||||||| How many do you want to collect |||||||||||||||||||\n");
-  int runs = 0;
-  readNumberFromTerminal(&runs);
+  int runs = cycles_arg;
+  if(runs < 0){
+    printf("||||||||||| How many do you want to collect |||||||||||||||||||\n");
+    readNumberFromTerminal(&runs);
+  }
 
-  printf("||||||||||| How many threads (0 for max) |||||||||||||||||||\n");
-  int used_threads = 0;
-  readNumberFromTerminal(&used_threads);
+  int used_threads = threads_arg;
+  if(used_threads < 0){
+    printf("||||||||||| How many threads (0 for max) |||||||||||||||||||\n");
+    readNumberFromTerminal(&used_threads);
+  }
   set_num_of_threads(used_threads);
 
 
@@ -811,7 +1035,7 @@ int main(int argc, char *argv[])
 
   
     if (argc < 2) {
-        printf("Usage: %s <directory> [--change_e <number>]\n", argv[0]);
+        printf("Usage: %s <directory> [--change_e <number>] [--binary] [--cycles <number>] [--threads <number>] [--stop-file <file>] [--seed <number>]\n", argv[0]);
         return 1;
     }
 
@@ -821,18 +1045,35 @@ int main(int argc, char *argv[])
     int change_e_flag = 0;
     int change_e_value = 0;
 
-    // Optionales Argument prüfen
-    if (argc >= 3) {
-        if (strcmp(argv[2], "--change_e") == 0) {
-            if (argc >= 4) {
+    // Optionale Argumente prüfen
+    for (int i = 2; i < argc; i++) {
+        if (strcmp(argv[i], "--change_e") == 0) {
+            if (i + 1 < argc) {
                 change_e_flag = 1;
-                change_e_value = atoi(argv[3]);
+                change_e_value = atoi(argv[++i]);
             } else {
                 printf("Error: --change_e benötigt eine Zahl!\n");
                 return 1;
             }
+        } else if (strcmp(argv[i], "--binary") == 0) {
+            printf("--binary aktiviert, schreibe %s\n", data_bin_file_name);
+            set_save_binary();
+        } else if ((strcmp(argv[i], "--cycles") == 0 || strcmp(argv[i], "--threads") == 0 ||
+                    strcmp(argv[i], "--stop-file") == 0 || strcmp(argv[i], "--seed") == 0) && i + 1 < argc) {
+            if (strcmp(argv[i], "--cycles") == 0)
+                cycles_arg = atoi(argv[i + 1]);
+            else if (strcmp(argv[i], "--threads") == 0)
+                threads_arg = atoi(argv[i + 1]);
+            else if (strcmp(argv[i], "--seed") == 0) {
+                // distinct seeds for runs that are merged later (campaign.py)
+                printf("--seed %s\n", argv[i + 1]);
+                srand((unsigned int)strtoul(argv[i + 1], NULL, 10));
+            }
+            else
+                snprintf(stop_file, file_name_length, "%s", argv[i + 1]);
+            i++;
         } else {
-            printf("Unbekanntes Argument: %s\n", argv[2]);
+            printf("Unbekanntes Argument: %s\n", argv[i]);
             return 1;
         }
     }
@@ -0,0 +1,150 @@
+"""
+Running totals of a data.bin or data.txt file that test.out is still writing.
+
+The aggregator remembers how far it has read and only parses the chunks that
+were appended since the last update, so the current estimate of a long
+collection costs one read of the new data:
+
+    import dist_aggregate
+    agg = dist_aggregate.Aggregator('test_key/data.bin')
+    for agg in agg.follow(interval=60):
+        lower, upper = agg.wilson_interval(0)
+        print(agg.cycles, agg.failure_rate)
+
+Per distance d and error vector e0/e1 (index 0/1), rate(e)[d] is the failure
+rate of the decryptions whose error vector contained d (DS_h0 / DS_h1 in
+testing.ipynb), normalized(e) divides it by the overall failure rate so
+valleys are below 1, and wilson_interval(e) gives the Wilson score interval
+of rate(e).
+"""
+import os
+import time
+
+import numpy as np
+
+import dist_data
+
+
+def wilson_interval(failures, total, z=1.96):
+    """
+    Wilson score interval of the failure rate failures/total, element-wise.
+    Entries without samples get the interval [0, 1].
+    """
+    failures = np.asarray(failures, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = failures / total
+        denominator = 1 + z * z / total
+        center = (p + z * z / (2 * total)) / denominator
+        half = z / denominator * np.sqrt(p * (1 - p) / total + z * z / (4 * total * total))
+    lower = np.where(total > 0, center - half, 0.0)
+    upper = np.where(total > 0, center + half, 1.0)
+    return lower, upper
+
+
+class Aggregator(object):
+    """Incremental sums over the chunks of one data file"""
+
+    def __init__(self, path, z=1.96):
+        self.path = path
+        self.z = z
+        self.binary = path.endswith('.bin')
+        self.offset = 0
+        self.pending = []
+        self.record_dtype = None
+        self.chunks = 0
+        self.count_succ = 0
+        self.cycles = 0
+        # (2, spec_len) sums for e0/e1, None until the first chunk was read
+        self.dist_spec = None
+        self.dist_spec_sum = None
+
+    def _add(self, chunks):
+        if len(chunks) == 0:
+            return
+        succ, cycles, ds_0, ds_sum_0, ds_1, ds_sum_1 = dist_data.totals(chunks)
+        if self.dist_spec is None:
+            self.dist_spec = np.zeros((2, len(ds_0)), dtype=np.int64)
+            self.dist_spec_sum = np.zeros((2, len(ds_0)), dtype=np.int64)
+        self.chunks += len(chunks)
+        self.count_succ += succ
+        self.cycles += cycles
+        self.dist_spec += (ds_0, ds_1)
+        self.dist_spec_sum += (ds_sum_0, ds_sum_1)
+
+    def _read_binary(self):
+        if self.record_dtype is None:
+            header = dist_data.read_header(self.path)
+            if header is None:
+                return 0
+            self.record_dtype = dist_data.chunk_dtype(int(header['spec_len']))
+        count = (os.path.getsize(self.path) - self.offset) // self.record_dtype.itemsize
+        if count <= 0:
+            return 0
+        chunks = np.fromfile(self.path, dtype=self.record_dtype, count=count, offset=self.offset)
+        self.offset += count * self.record_dtype.itemsize
+        self._add(chunks)
+        return count
+
+    def _read_text(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # only consume complete lines, the writer may be in the middle of one
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        chunks = []
+        for line in data[:end].decode().splitlines(keepends=True):
+            self.pending.append(line)
+            if len(self.pending) == 5:
+                chunks.append(dist_data.parse_text_chunk(self.pending))
+                self.pending = []
+        if chunks:
+            self._add(np.stack(chunks))
+        return len(chunks)
+
+    def update(self):
+        """Adds the chunks appended since the last call, returns their number"""
+        if not os.path.exists(self.path):
+            return 0
+        if self.binary:
+            return self._read_binary()
+        return self._read_text()
+
+    def follow(self, interval=10.0, timeout=None):
+        """
+        Yields the aggregator every time new chunks arrived, polling the file
+        every interval seconds. Stops after timeout seconds without new chunks.
+        """
+        last = time.monotonic()
+        while True:
+            if self.update() > 0:
+                last = time.monotonic()
+                yield self
+            elif timeout is not None and time.monotonic() - last > timeout:
+                return
+            else:
+                time.sleep(interval)
+
+    @property
+    def failure_rate(self):
+        if self.cycles == 0:
+            return 0.0
+        return 1 - self.count_succ / self.cycles
+
+    def rate(self, e=0):
+        """Failure rate per distance of error vector e, 0 where it was never seen"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = self.dist_spec[e] / self.dist_spec_sum[e]
+        rate[np.isnan(rate)] = 0
+        return rate
+
+    def normalized(self, e=0):
+        """rate(e) relative to the overall failure rate"""
+        if self.failure_rate == 0:
+            return np.zeros(self.dist_spec.shape[1])
+        return self.rate(e) / self.failure_rate
+
+    def wilson_interval(self, e=0):
+        """(lower, upper) Wilson score interval of rate(e)"""
+        return wilson_interval(self.dist_spec[e], self.dist_spec_sum[e], self.z)
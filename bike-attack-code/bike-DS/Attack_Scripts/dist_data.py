@@ -0,0 +1,118 @@
+"""
+Reader for the distance spectrum chunks written by test.out (codebase/test.c).
+
+Every chunk holds the number of successful decryptions (succ) out of
+chunk_size, and per error vector e0/e1 the failures (dist_spec) and the total
+number of error vectors (dist_spec_sum) that contained a distance.
+
+ - "data.bin" (test.out --binary): fixed-size records of little-endian int32,
+   a header (magic "BKDS", version, level, r_bits, spec_len, chunk_size,
+   succ, reserved) followed by dist_spec_0, dist_spec_sum_0, dist_spec_1 and
+   dist_spec_sum_1 with spec_len entries each. read_binary memory-maps it.
+ - "data.txt": a "succ,chunk_size" line followed by the four arrays as
+   comma-separated lines. read_text parses it into the same structure.
+
+    import dist_data
+    chunks = dist_data.read('test_key/data.bin')
+    succ, total, ds0, sum0, ds1, sum1 = dist_data.totals(chunks)
+"""
+import os
+
+import numpy as np
+
+
+magic = b'BKDS'
+version = 1
+header_dtype = np.dtype([
+    ('magic', 'S4'), ('version', '<i4'), ('level', '<i4'), ('r_bits', '<i4'),
+    ('spec_len', '<i4'), ('chunk_size', '<i4'), ('succ', '<i4'), ('reserved', '<i4'),
+])
+spectra = ['dist_spec_0', 'dist_spec_sum_0', 'dist_spec_1', 'dist_spec_sum_1']
+
+
+def chunk_dtype(spec_len):
+    """Structured dtype of one record of a data.bin file"""
+    return np.dtype(header_dtype.descr + [(name, '<i4', (spec_len,)) for name in spectra])
+
+
+def read_header(path):
+    """The header of the first record of a data.bin file, None if it is empty"""
+    with open(path, 'rb') as f:
+        raw = f.read(header_dtype.itemsize)
+    if len(raw) < header_dtype.itemsize:
+        return None
+    header = np.frombuffer(raw, dtype=header_dtype)[0]
+    if header['magic'] != magic:
+        raise ValueError(f"{path} is not a distance spectrum file")
+    if header['version'] != version:
+        raise ValueError(f"{path} has version {header['version']}, expected {version}")
+    return header
+
+
+def read_binary(path, amount=None):
+    """
+    Memory-maps the records of a data.bin file as a read-only structured
+    array. A partially written last record is left out. amount limits the
+    number of records.
+    """
+    header = read_header(path)
+    if header is None:
+        return np.zeros(0, dtype=chunk_dtype(0))
+    dtype = chunk_dtype(int(header['spec_len']))
+    count = os.path.getsize(path) // dtype.itemsize
+    if amount is not None:
+        count = min(count, amount)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def parse_text_chunk(lines):
+    """One chunk of data.txt (five lines) as a record of chunk_dtype"""
+    succ, chunk_size = np.array(lines[0].split(',')[:2], dtype=np.int64)
+    # test.c ends every line with a separator
+    arrays = [np.array(line.strip().rstrip(',').split(','), dtype=np.int64)
+              for line in lines[1:]]
+    chunk = np.zeros((), dtype=chunk_dtype(len(arrays[0])))
+    chunk['magic'] = magic
+    chunk['version'] = version
+    chunk['spec_len'] = len(arrays[0])
+    chunk['chunk_size'] = chunk_size
+    chunk['succ'] = succ
+    for name, array in zip(spectra, arrays):
+        chunk[name] = array
+    return chunk
+
+
+def read_text(path, amount=None):
+    """The complete chunks of a data.txt file as a structured array"""
+    chunks = []
+    lines = []
+    with open(path, 'r') as f:
+        for line in f:
+            if amount is not None and len(chunks) == amount:
+                break
+            lines.append(line)
+            if len(lines) == 5:
+                chunks.append(parse_text_chunk(lines))
+                lines = []
+    if not chunks:
+        return np.zeros(0, dtype=chunk_dtype(0))
+    return np.stack(chunks)
+
+
+def read(path, amount=None):
+    """Chunks of a data.bin or data.txt file, chosen by the extension"""
+    if path.endswith('.bin'):
+        return read_binary(path, amount)
+    return read_text(path, amount)
+
+
+def totals(chunks):
+    """
+    Sums over the chunks: (count_succ, count_sum, dist_spec_0,
+    dist_spec_sum_0, dist_spec_1, dist_spec_sum_1), as int64.
+    """
+    sums = [chunks[name].sum(axis=0, dtype=np.int64) for name in spectra]
+    return (int(chunks['succ'].sum(dtype=np.int64)),
+            int(chunks['chunk_size'].sum(dtype=np.int64)), *sums)
@@ -0,0 +1,198 @@
+"""
+Batched cyclic distance spectra for BIKE keys and error vectors.
+
+The distance spectrum of a vector of length r counts, for every distance
+d in [0, r//2], the pairs of set positions whose cyclic distance
+min(b - a, r - (b - a)) is d. All functions take a whole batch at once:
+
+ - weight lists: (n, w) integer arrays of set positions. Rows with fewer
+   positions are padded with -1 (see wlists_from_bits).
+ - packed bit vectors: (n, ceil(r/8)) uint8 arrays, least significant bit
+   first, as stored by BIKE and written to key.txt.
+ - bit vectors: (n, r) arrays of 0/1.
+
+Sparse inputs are handled by a pairwise-difference kernel, dense ones by a
+cyclic autocorrelation computed with the FFT. distance_spec picks the kernel.
+
+    import dist_spec
+    spec = dist_spec.distance_spec(h0)              # one key, (num_dist,)
+    specs = dist_spec.distance_spec(error_vectors)  # (n, num_dist)
+"""
+import numpy as np
+
+
+num_bits = 12323
+num_bytes = (num_bits + 7) // 8
+num_dist = num_bits // 2 + 1
+
+# above this weight the FFT kernel is faster than the pairwise one
+max_pairwise_weight = 256
+
+# rows per batch, bounds the temporary memory of both kernels
+pairwise_batch_elements = 1 << 22
+fft_batch_rows = 256
+
+
+def unpack_bits(packed, r=num_bits):
+    """(n, ceil(r/8)) uint8 -> (n, r) uint8 bit vectors"""
+    if isinstance(packed, (bytes, bytearray)):
+        packed = np.frombuffer(packed, dtype=np.uint8)
+    packed = np.asarray(packed, dtype=np.uint8)
+    return np.unpackbits(packed, axis=-1, count=r, bitorder='little')
+
+
+def wlists_from_bits(bits):
+    """(n, r) bit vectors -> (n, max weight) sorted weight lists padded with -1"""
+    bits = np.atleast_2d(np.asarray(bits)) != 0
+    weights = bits.sum(axis=1)
+    wlists = np.full((bits.shape[0], weights.max(initial=0)), -1, dtype=np.int32)
+    rows, cols = np.nonzero(bits)
+    # np.nonzero is row-major, so the positions of each row come sorted
+    offsets = np.cumsum(weights) - weights
+    wlists[rows, np.arange(len(rows)) - np.repeat(offsets, weights)] = cols
+    return wlists
+
+
+def wlists_from_bytes(packed, r=num_bits):
+    """(n, ceil(r/8)) packed bit vectors -> (n, max weight) weight lists"""
+    return wlists_from_bits(unpack_bits(packed, r))
+
+
+def pair_distances(wlists, r=num_bits):
+    """
+    Cyclic distances of all pairs i < j of each weight list, (n, w*(w-1)/2).
+    Pairs involving padding (-1) get distance -1.
+    """
+    wlists = np.atleast_2d(np.asarray(wlists, dtype=np.int64))
+    i, j = np.triu_indices(wlists.shape[1], k=1)
+    a, b = wlists[:, i], wlists[:, j]
+    diff = np.abs(b - a)
+    dist = np.minimum(diff, r - diff)
+    dist[(a < 0) | (b < 0)] = -1
+    return dist
+
+
+def _counts(dist, length, unique):
+    """Per-row histogram of the non-negative entries of dist"""
+    n = dist.shape[0]
+    valid = dist >= 0
+    flat = (np.arange(n)[:, None] * length + dist)[valid]
+    if unique:
+        flat = np.unique(flat)
+    return np.bincount(flat, minlength=n * length).reshape(n, length)
+
+
+def pairwise_distance_spec(wlists, r=num_bits, unique=False):
+    """
+    Distance spectra of (n, w) weight lists, (n, r//2+1) int64.
+    With unique=True a distance is counted at most once per row, as
+    update_dist_spec in codebase/test.c does.
+    """
+    wlists = np.atleast_2d(np.asarray(wlists))
+    length = r // 2 + 1
+    npairs = max(1, wlists.shape[1] * (wlists.shape[1] - 1) // 2)
+    step = max(1, pairwise_batch_elements // npairs)
+    spec = np.empty((wlists.shape[0], length), dtype=np.int64)
+    for start in range(0, wlists.shape[0], step):
+        dist = pair_distances(wlists[start:start + step], r)
+        spec[start:start + step] = _counts(dist, length, unique)
+    return spec
+
+
+def fft_distance_spec(bits, r=num_bits, unique=False):
+    """
+    Distance spectra of (n, r) bit vectors via the cyclic autocorrelation,
+    (n, r//2+1) int64. A pair at cyclic distance d is counted once in the
+    autocorrelation at lag d, so the spectrum is its first half (without the
+    weight at lag 0).
+    """
+    bits = np.atleast_2d(np.asarray(bits))
+    length = r // 2 + 1
+    spec = np.empty((bits.shape[0], length), dtype=np.int64)
+    for start in range(0, bits.shape[0], fft_batch_rows):
+        f = np.fft.rfft(bits[start:start + fft_batch_rows], n=r, axis=1)
+        autocorr = np.fft.irfft(f * np.conj(f), n=r, axis=1)[:, :length]
+        spec[start:start + fft_batch_rows] = np.rint(autocorr)
+    spec[:, 0] = 0
+    if r % 2 == 0:
+        # for even r the lags r/2 and r - r/2 coincide
+        spec[:, r // 2] //= 2
+    if unique:
+        spec = np.minimum(spec, 1)
+    return spec
+
+
+def distance_spec(x, r=num_bits, unique=False):
+    """
+    Distance spectra of weight lists, packed or unpacked bit vectors, see the
+    module docstring. A single vector gives a (r//2+1,) spectrum, a batch a
+    (n, r//2+1) one.
+    """
+    if isinstance(x, (bytes, bytearray)):
+        x = np.frombuffer(x, dtype=np.uint8)
+    x = np.asarray(x)
+    single = x.ndim == 1
+    x = np.atleast_2d(x)
+    if x.dtype == np.uint8 and x.shape[1] == (r + 7) // 8:
+        x = unpack_bits(x, r)
+    if x.shape[1] == r and x.max(initial=0) <= 1:
+        if x.sum(axis=1).max(initial=0) > max_pairwise_weight:
+            spec = fft_distance_spec(x, r, unique)
+        else:
+            spec = pairwise_distance_spec(wlists_from_bits(x), r, unique)
+    else:
+        spec = pairwise_distance_spec(x, r, unique)
+    return spec[0] if single else spec
+
+
+# The block and valley rules below are the reference for the CNN valley finder:
+# ML/trace_data.py labels its training traces with valley_labels and
+# ML/CNN_DS_finder.py calls them for single keys.
+
+def block_centers(wlists, min_block=30):
+    """
+    Middle position of the longest run of consecutive positions of every
+    sorted weight list (n, w), the last run if several are equally long.
+    Raises ValueError if a list has no run of at least min_block positions.
+    """
+    wlists = np.atleast_2d(np.asarray(wlists))
+    n, w = wlists.shape
+    run_start = np.ones((n, w), dtype=bool)
+    run_start[:, 1:] = np.diff(wlists, axis=1) != 1
+    run_id = np.cumsum(run_start, axis=1) - 1
+    rows = np.arange(n)
+    lengths = np.bincount((rows[:, None] * w + run_id).ravel(),
+                          minlength=n * w).reshape(n, w)
+    best = w - 1 - np.argmax(lengths[:, ::-1], axis=1)
+    best_len = lengths[rows, best]
+    if (best_len < min_block).any():
+        raise ValueError(f"No valid block in key {np.flatnonzero(best_len < min_block)[0]}")
+    start = np.argmax(run_id == best[:, None], axis=1)
+    return wlists[rows, start + best_len // 2]
+
+
+def block_center(wlist, min_block=30):
+    """block_centers of a single sorted weight list"""
+    return block_centers(np.asarray(wlist)[None], min_block)[0]
+
+
+def valley_labels(wlists, r=num_bits, min_block=30, ignore=100):
+    """
+    (n, r//2 + 1) uint8 labels of sorted weight lists (n, w) of keys with a
+    block: 1 at the cyclic distances between the block center and the
+    positions, i.e., the valleys the CNN is trained to find. Positions up to
+    ignore and distances below it are left out.
+    """
+    wlists = np.atleast_2d(np.asarray(wlists, dtype=np.int64))
+    diff = np.abs(wlists - block_centers(wlists, min_block)[:, None])
+    dist = np.minimum(diff, r - diff)
+    mask = (wlists > ignore) & (dist >= ignore)
+    rows = np.broadcast_to(np.arange(len(wlists))[:, None], wlists.shape)
+    labels = np.zeros((len(wlists), r // 2 + 1), dtype=np.uint8)
+    labels[rows[mask], dist[mask]] = 1
+    return labels
+
+
+def valley_distances(wlist, r=num_bits, min_block=30, ignore=100):
+    """The valleys (valley_labels) of a single weight list, sorted"""
+    return np.flatnonzero(valley_labels(np.sort(np.asarray(wlist))[None], r, min_block, ignore)[0])
@@ -0,0 +1,113 @@
+"""
+Runs test.out on a key folder and stops the collection once enough valleys of
+the distance spectrum are recoverable.
+
+    python early_stop.py test_key --cycles 9000000 --change_e 4
+
+test.out writes data.bin (--binary) into the folder. Every --interval seconds
+the new chunks are added to the running totals (dist_aggregate.py) and the
+valleys of the reference key in key.txt (dist_spec.valley_distances) are
+checked: a valley counts as recovered if it is among the --top-k lowest
+distances, ranked by the upper bound of the Wilson interval of their failure
+rate, and that upper bound is below the median failure rate of all distances.
+Once at most --max-missed valleys are missing, the stop file is created and
+test.out stops after the chunk each thread is working on. Chunks already in
+data.bin from earlier runs are part of the estimate.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import dist_aggregate
+import dist_spec
+
+
+def read_wlist(key_path):
+    """Weight list of h0 (the first 71 little-endian uint32) of the first key in key.txt"""
+    with open(key_path, 'r') as f:
+        key = bytes.fromhex(f.readline().strip())
+    return np.frombuffer(key[:71 * 4], dtype='<u4').astype(np.int64)
+
+
+def recovered_valleys(agg, valleys, top_k=0.2, ignore=100):
+    """Boolean mask over valleys, see the module docstring"""
+    lower, upper = agg.wilson_interval(0)
+    candidates = np.arange(ignore, len(upper))
+    k = max(1, round(top_k * len(candidates)))
+    top = candidates[np.argpartition(upper[candidates], k - 1)[:k]]
+    baseline = np.median(agg.rate(0)[candidates])
+    return np.isin(valleys, top) & (upper[valleys] < baseline)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Collect the distance spectrum of a key until its valleys are recoverable",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    parser.add_argument("folder", help="Folder with key.txt")
+    parser.add_argument("--cycles", type=int, required=True, help="Maximal number of decryptions")
+    parser.add_argument("--threads", type=int, default=0, help="OpenMP threads (default 0: all)")
+    parser.add_argument("--change_e", type=int, help="Passed on to test.out")
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between checks (default 30)")
+    parser.add_argument("--top-k", type=float, default=0.2,
+                        help="Fraction of the distances a valley has to be ranked in (default 0.2)")
+    parser.add_argument("--max-missed", type=int, default=2,
+                        help="Tolerated number of valleys that are not recovered (default 2)")
+    parser.add_argument("--z", type=float, default=1.96, help="z-score of the Wilson intervals (default 1.96)")
+    parser.add_argument("--test-out", default="./test.out", help="Path of test.out")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    data_path = os.path.join(args.folder, "data.bin")
+    stop_path = os.path.join(args.folder, "stop")
+    if os.path.exists(stop_path):
+        os.remove(stop_path)
+
+    valleys = dist_spec.valley_distances(read_wlist(os.path.join(args.folder, "key.txt")))
+    agg = dist_aggregate.Aggregator(data_path, z=args.z)
+    agg.update()
+    cycles_before = agg.cycles
+
+    command = [args.test_out, args.folder, "--binary", "--cycles", str(args.cycles),
+               "--threads", str(args.threads), "--stop-file", stop_path]
+    if args.change_e is not None:
+        command += ["--change_e", str(args.change_e)]
+    print(f"{len(valleys)} valleys in {args.folder}/key.txt, running {' '.join(command)}")
+    with open(os.path.join(args.folder, "test_out.log"), "w") as log:
+        proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+
+    stopped = False
+    while proc.poll() is None:
+        time.sleep(args.interval)
+        if stopped or agg.update() == 0:
+            continue
+        missed = len(valleys) - int(recovered_valleys(agg, valleys, args.top_k).sum())
+        print(f"{agg.cycles - cycles_before} decryptions: {len(valleys) - missed} of "
+              f"{len(valleys)} valleys recovered", flush=True)
+        if missed <= args.max_missed:
+            open(stop_path, "w").close()
+            stopped = True
+
+    agg.update()
+    if os.path.exists(stop_path):
+        os.remove(stop_path)
+    if proc.returncode != 0:
+        print(f"test.out failed with exit code {proc.returncode}, see {args.folder}/test_out.log")
+        sys.exit(1)
+
+    run = agg.cycles - cycles_before
+    missed = len(valleys) - int(recovered_valleys(agg, valleys, args.top_k).sum())
+    print(f"ran {run} of {args.cycles} decryptions ({args.cycles - run} saved), "
+          f"{len(valleys) - missed} of {len(valleys)} valleys recovered")
+    if missed > args.max_missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Tests of campaign.py that do not need test.out; run with python -m pytest.
+"""
+import argparse
+import os
+import stat
+import sys
+
+import numpy as np
+
+import campaign
+import dist_data
+
+
+spec_len = 16
+
+# stands in for test.out: appends one record for the missing cycles to data.bin
+fake_test_out = f"""#!{sys.executable}
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+import numpy as np
+import dist_data
+record = np.zeros(1, dtype=dist_data.chunk_dtype({spec_len}))
+record['magic'] = dist_data.magic
+record['version'] = dist_data.version
+record['spec_len'] = {spec_len}
+record['chunk_size'] = int(sys.argv[sys.argv.index('--cycles') + 1])
+with open('data.bin', 'ab') as f:
+    f.write(record.tobytes())
+"""
+
+
+def make_records(sizes):
+    records = np.zeros(len(sizes), dtype=dist_data.chunk_dtype(spec_len))
+    records['magic'] = dist_data.magic
+    records['version'] = dist_data.version
+    records['spec_len'] = spec_len
+    records['chunk_size'] = sizes
+    return records
+
+
+def make_campaign(tmp_path, cycles):
+    (tmp_path / "key.txt").write_text("00\n")
+    test_out = tmp_path / "test.out"
+    test_out.write_text(fake_test_out)
+    test_out.chmod(test_out.stat().st_mode | stat.S_IEXEC)
+    args = argparse.Namespace(folder=str(tmp_path), cycles=cycles, shards=1, seed=1, change_e=None,
+                              threads=1, test_out=str(test_out))
+    return args, campaign.prepare_shards(args)[0]
+
+
+def test_resume_after_truncated_record(tmp_path):
+    args, path = make_campaign(tmp_path, 1000)
+    data_path = os.path.join(path, "data.bin")
+    # two complete records and half of a third one, as left by a killed test.out
+    records = make_records([300, 200, 100])
+    with open(data_path, "wb") as f:
+        f.write(records[:2].tobytes())
+        f.write(records[2:].tobytes()[:records.itemsize // 2])
+
+    assert campaign.start_shard(args, path).wait() == 0
+
+    chunks = dist_data.read_binary(data_path)
+    assert os.path.getsize(data_path) == 3 * records.itemsize
+    assert list(chunks['chunk_size']) == [300, 200, 500]
+    assert (chunks['magic'] == dist_data.magic).all()
+    assert campaign.cycles_done(path) == (1000, 3)
+    assert campaign.start_shard(args, path) is None
+
+
+def test_resume_after_truncated_header(tmp_path):
+    args, path = make_campaign(tmp_path, 1000)
+    data_path = os.path.join(path, "data.bin")
+    with open(data_path, "wb") as f:
+        f.write(make_records([300]).tobytes()[:10])
+
+    assert campaign.start_shard(args, path).wait() == 0
+
+    chunks = dist_data.read_binary(data_path)
+    assert list(chunks['chunk_size']) == [1000]
@@ -10,7 +10,8 @@ if __name__ == "__main__":
         schemes = [s for s in rest if s not in ['--nostack',
                                                 '--nospeed',
                                                 '--nohashing',
-                                                '--nosize']]
+                                                '--nosize',
+                                                '--profiling']]
         if "--nostack" not in rest:
             test = mupq.StackBenchmark(settings, platform)
             if test.test_all(schemes):
@@ -30,3 +31,8 @@ if __name__ == "__main__":
             test = mupq.SizeBenchmark(settings, platform)
             if test.test_all(schemes):
                 sys.exit(1)
+
+        if "--profiling" in rest:
+            test = mupq.ProfilingBenchmark(settings, platform)
+            if test.test_all(schemes):
+                sys.exit(1)
@@ -12,4 +12,5 @@ if __name__ == "__main__":
     args, rest = parse_arguments()
     platform, settings = get_platform(args)
     with platform:
-        mupq.BuildAll(settings).test_all(rest)
+        if mupq.BuildAll(settings).test_all(rest):
+            sys.exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compares two sets of benchmark results, e.g., two git revisions or two sets of
+optimization flags, and exits with an error if a scheme got significantly
+slower than the threshold allows.
+
+    python3 compare_benchmarks.py --base gitrev=1a2b3c4 --new gitrev=5d6e7f8
+    python3 compare_benchmarks.py --base optflags=AIO=1 --new "optflags=LTO=1 AIO=1" bikel1
+"""
+import argparse
+import sys
+
+from mupq import compare
+from mupq import results
+
+
+def parse_filter(value):
+    column, sep, match = value.partition("=")
+    if not sep or column not in ("platform", "optflags", "gitrev"):
+        raise argparse.ArgumentTypeError("expected platform=..., optflags=... or gitrev=...")
+    return column, match
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Compare two sets of benchmark results",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    parser.add_argument("--base", type=parse_filter, action="append", default=[],
+                        help="Select the baseline runs, e.g., gitrev=1a2b3c4 (repeatable)")
+    parser.add_argument("--new", type=parse_filter, action="append", default=[],
+                        help="Select the runs to compare, e.g., optflags=LTO=1 AIO=1 (repeatable)")
+    parser.add_argument("--base-db", default=results.ResultStore.dbfile,
+                        help="Result database of the baseline")
+    parser.add_argument("--new-db", default=results.ResultStore.dbfile,
+                        help="Result database of the runs to compare")
+    parser.add_argument("-b", "--benchmark", default="speed",
+                        choices=["speed", "stack", "hashing", "size", "profiling"])
+    parser.add_argument("-t", "--threshold", type=float, default=1.0,
+                        help="Tolerated increase in percent (default 1.0)")
+    parser.add_argument("-a", "--alpha", type=float, default=0.05,
+                        help="Significance level (default 0.05)")
+    parser.add_argument("-c", "--confidence", type=float, default=0.95,
+                        help="Confidence level of the median intervals (default 0.95)")
+    parser.add_argument("schemes", nargs="*", help="Only compare these schemes")
+    return parser.parse_args()
+
+
+def format_median(median, ci):
+    return f"{median:,.0f} [{ci[0]:,} - {ci[1]:,}]"
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    base_store = results.ResultStore(args.base_db)
+    new_store = results.ResultStore(args.new_db)
+    # pick up result files of the local benchmarks/ tree, once if both are the same database
+    if base_store.dbfile == results.ResultStore.dbfile:
+        base_store.import_tree()
+    if args.new_db != args.base_db and new_store.dbfile == results.ResultStore.dbfile:
+        new_store.import_tree()
+    comparisons = compare.compare(base_store, dict(args.base), new_store, dict(args.new),
+                                  args.benchmark, schemes=args.schemes,
+                                  confidence=args.confidence)
+    if len(comparisons) == 0:
+        print("No common results found")
+        sys.exit(1)
+
+    columns = ["scheme", "implementation", "metric", "base median [CI]",
+               "new median [CI]", "delta", "p-value", ""]
+    print("| " + " | ".join(columns) + " |")
+    print("| " + " | ".join(["-" * len(c) for c in columns]) + " |")
+    regressions = 0
+    for c in comparisons:
+        flag = ""
+        if compare.is_regression(c, args.threshold, args.alpha):
+            flag = "REGRESSION"
+            regressions += 1
+        elif compare.is_improvement(c, args.threshold, args.alpha):
+            flag = "improved"
+        delta = "n/a" if c.delta is None else f"{c.delta:+.2f}%"
+        pvalue = "n/a" if c.pvalue is None else f"{c.pvalue:.3g}"
+        print("| " + " | ".join([
+            c.scheme, c.implementation, c.metric,
+            f"{format_median(c.base_median, c.base_ci)} ({c.base_n})",
+            f"{format_median(c.new_median, c.new_ci)} ({c.new_n})",
+            delta, pvalue, flag]) + " |")
+
+    if regressions:
+        print(f"\n{regressions} significant regressions above {args.threshold}%")
+        sys.exit(1)
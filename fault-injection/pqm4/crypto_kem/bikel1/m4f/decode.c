@@ -40,6 +40,7 @@
 #include "cleanup.h"
 #include "ring_ops.h"
 #include "utilities.h"
+#include "profiling.h"
 
 #include "run_config.h"
 
@@ -777,7 +778,9 @@ ret_t decode(OUT e_t *e, IN const ct_t *ct, IN const sk_t *sk)
 
   DEFER_CLEANUP(syndrome_t s = {0}, syndrome_cleanup);
   DMSG("  Computing s.\n");
+  PROFILE_BEGIN(compute_syndrome);
   GUARD(compute_syndrome(&s, &c0, &th0));
+  PROFILE_END(compute_syndrome);
   //dup(&s);
 
   // Reset (init) the error because it is xored in the find_err functions.
@@ -791,8 +794,10 @@ ret_t decode(OUT e_t *e, IN const ct_t *ct, IN const sk_t *sk)
          r_bits_vector_weight(&e->val[0]) + r_bits_vector_weight(&e->val[1]));
     DMSG("    Weight of syndrome: %lu\n", r_bits_vector_weight((r_t *)s.qw));
 
+    PROFILE_BEGIN(find_err1);
     find_err1(e, &black_e, &gray_e, &s, sk->wlist, threshold);
     GUARD(recompute_syndrome(&s, &c0, &th0, &pk, e));
+    PROFILE_END(find_err1);
 #if defined(BGF_DECODER)
     if(iter >= 1) {
       continue;
@@ -802,6 +807,7 @@ ret_t decode(OUT e_t *e, IN const ct_t *ct, IN const sk_t *sk)
          r_bits_vector_weight(&e->val[0]) + r_bits_vector_weight(&e->val[1]));
     DMSG("    Weight of syndrome: %lu\n", r_bits_vector_weight((r_t *)s.qw));
 
+    PROFILE_BEGIN(find_err2);
     find_err2(e, &black_e, &s, sk->wlist, ((D + 1) / 2) + 1);
     GUARD(recompute_syndrome(&s, &c0, &th0, &pk, e));
 
@@ -811,6 +817,7 @@ ret_t decode(OUT e_t *e, IN const ct_t *ct, IN const sk_t *sk)
 
     find_err2(e, &gray_e, &s, sk->wlist, ((D + 1) / 2) + 1);
     GUARD(recompute_syndrome(&s, &c0, &th0, &pk, e));
+    PROFILE_END(find_err2);
   }
 
   if(r_bits_vector_weight((r_t *)s.qw) > 0) {
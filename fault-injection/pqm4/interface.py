@@ -1,7 +1,8 @@
 import argparse
+import atexit
 
 from mupq import mupq
-from mupq import platforms
+from mupq import trace
 
 
 def parse_arguments():
@@ -26,28 +27,55 @@ def parse_arguments():
     parser.add_argument(
         "--no-aio", help="Disable all-in-one compilation", default=False, action="store_true"
     )
-    parser.add_argument("-u", "--uart", default="/dev/ttyUSB0", help="Path to UART output")
+    parser.add_argument("-u", "--uart", action="append", help="Path to UART output, repeat for several boards (default: /dev/ttyUSB0)")
+    parser.add_argument("--probe", action="append", default=[], help="Serial number of the debug probe of each board, in the order of --uart")
+    parser.add_argument("--boards", type=int, default=None, help="Number of emulator instances to run tests on (mps2-an386, default: one per core)")
+    parser.add_argument("--timeout", type=float, default=120, help="Deadline per iteration of a run on the emulator or a board in seconds")
     parser.add_argument("-i", "--iterations", type=int, default=1, help="Number of iterations for benchmarks")
+    parser.add_argument("--target-ci", type=float, default=None, help="Rerun speed benchmarks until the confidence interval of every operation is within this many percent of the median")
+    parser.add_argument("--time-budget", type=float, default=600, help="Maximum time in seconds spent on the reruns of one implementation (with --target-ci)")
+    parser.add_argument("--trace", metavar="FILE", default=None, help="Write a Chrome trace of the make, flash and run times to FILE and print a summary at exit")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of concurrent builds (default: one per core)")
     return parser.parse_known_args()
 
 
 def get_platform(args):
+    """
+    Returns the platform and its settings
+
+    If several boards are given (multiple --uart or --boards), the platform is
+    a mupq.PlatformPool the tests are distributed over.
+    """
     platform = None
     bin_type = 'bin'
+    # only the backend of the selected platform and its dependencies are loaded
+    from mupq import platforms
+    if args.trace:
+        atexit.register(trace.tracer.export, args.trace)
+    uarts = args.uart if args.uart else ["/dev/ttyUSB0"]
+    probes = args.probe + [None] * (len(uarts) - len(args.probe))
     if args.platform in ['stm32f4discovery', 'nucleo-l476rg']:
-        platform = platforms.StLink(args.uart)
+        boards = [platforms.StLink(uart, probe=probe, run_timeout=args.timeout) for uart, probe in zip(uarts, probes)]
     elif args.platform == "nucleo-l4r5zi":
         bin_type = 'hex'
-        platform = platforms.OpenOCD("st_nucleo_l4r5.cfg", args.uart)
+        boards = [platforms.OpenOCD("st_nucleo_l4r5.cfg", uart, probe=probe, run_timeout=args.timeout)
+                  for uart, probe in zip(uarts, probes)]
     elif args.platform in ["cw308t-stm32f3", "cw308t-stm32f415"]:
         bin_type = 'hex'
-        platform = platforms.ChipWhisperer()
+        boards = [platforms.ChipWhisperer()]
     elif args.platform == 'mps2-an386':
         bin_type = 'bin'
-        platform = platforms.Qemu('qemu-system-arm', 'mps2-an386')
+        boards = platforms.QemuPool('qemu-system-arm', 'mps2-an386', args.boards, args.timeout).platforms
     else:
         raise NotImplementedError("Unsupported Platform")
-    settings = M4Settings(args.platform, args.opt, args.lto, not args.no_aio, args.iterations, bin_type)
+    if len(boards) == 1:
+        platform = boards[0]
+    else:
+        platform = mupq.PlatformPool(boards)
+    settings = M4Settings(args.platform, args.opt, args.lto, not args.no_aio, args.iterations, bin_type, args.jobs)
+    if args.target_ci is not None:
+        settings.target_ci = args.target_ci / 100
+        settings.time_budget = args.time_budget
     return platform, settings
 
 
@@ -71,25 +99,22 @@ class M4Settings(mupq.PlatformSettings):
         'nucleo-l4r5zi': 640*1024
     }
 
-    def __init__(self, platform, opt="speed", lto=False, aio=False, iterations=1, binary_type='bin'):
+    _estmemory = None
+
+    def __init__(self, platform, opt="speed", lto=False, aio=False, iterations=1, binary_type='bin', build_jobs=None):
         """Initialize with a specific platform"""
-        import skiplist
-        self.skip_list = []
-        for impl in skiplist.skip_list:
-            if impl['estmemory'] > self.platform_memory[platform]:
-                impl = impl.copy()
-                del impl['estmemory']
-                self.skip_list.append(impl)
-        self.skip_list.append({'implementation': 'vec'})
+        self.skip_list = [{'implementation': 'vec'}]
         self.binary_type = binary_type
         optflags = {"speed": [], "size": ["OPT_SIZE=1"], "debug": ["DEBUG=1"]}
         if opt not in optflags:
             raise ValueError(f"Optimization flag should be in {list(optflags.keys())}")
         super(M4Settings, self).__init__()
+        self.name = platform
         self.makeflags = [f"PLATFORM={platform}"]
         self.makeflags += [f"MUPQ_ITERATIONS={iterations}"]
         self.makeflags += optflags[opt]
         self.iterations = iterations
+        self.build_jobs = build_jobs
         if lto:
             self.makeflags += ["LTO=1"]
         else:
@@ -98,3 +123,31 @@ class M4Settings(mupq.PlatformSettings):
             self.makeflags += ["AIO=1"]
         else:
             self.makeflags += ["AIO="]
+
+    @property
+    def estmemory(self):
+        """memory_estimates(), loaded when the first implementation is checked"""
+        if self._estmemory is None:
+            self._estmemory = self.memory_estimates()
+        return self._estmemory
+
+    def memory_estimates(self):
+        """
+        {(scheme, implementation): estimated memory in bytes}
+
+        Measurements of update_skiplist.py with the same optimization flags
+        take precedence over the static skiplist.py.
+        """
+        import skiplist
+        estimates = dict()
+        for impl in skiplist.skip_list:
+            key = (impl['scheme'], impl['implementation'])
+            estimates[key] = max(impl['estmemory'], estimates.get(key, 0))
+        estimates.update(mupq.SkipListCache().estimates(self.optflags()))
+        return estimates
+
+    def should_skip(self, impl):
+        estmemory = self.estmemory.get((impl.scheme, impl.implementation), 0)
+        if estmemory > self.platform_memory[self.name]:
+            return True
+        return super().should_skip(impl)
@@ -0,0 +1,33 @@
+#ifndef PROFILING_H
+#define PROFILING_H
+
+/*
+ * Named cycle-counter regions for the profiling benchmark
+ * (mupq/crypto_kem/profiling.c). Regions are inclusive, i.e., nested regions
+ * are also counted in the enclosing one. Without PROFILE_REGIONS the macros
+ * expand to nothing.
+ *
+ *   PROFILE_BEGIN(gf2x_mod_inv);
+ *   gf2x_mod_inv(&h0inv, &h0);
+ *   PROFILE_END(gf2x_mod_inv);
+ */
+
+#ifdef PROFILE_REGIONS
+
+#include "hal.h"
+
+void profile_region_add(const char *name, unsigned long long cycles);
+
+#define PROFILE_BEGIN(name) \
+  const unsigned long long profile_start_##name = hal_get_time()
+#define PROFILE_END(name) \
+  profile_region_add(#name, hal_get_time() - profile_start_##name)
+
+#else
+
+#define PROFILE_BEGIN(name)
+#define PROFILE_END(name)
+
+#endif
+
+#endif /* PROFILING_H */
@@ -0,0 +1,107 @@
+"""
+Statistical comparison of two sets of benchmark results
+
+A result set is selected from a ResultStore by platform, optimization flags
+and/or git revision. For every scheme, implementation and metric both sets
+have in common, the medians with their confidence intervals, the change in
+percent and the p-value of a two-sided Mann-Whitney U test are reported.
+"""
+import math
+import statistics
+from collections import namedtuple
+
+
+Comparison = namedtuple("Comparison", [
+    "primitive", "scheme", "implementation", "metric",
+    "base_n", "base_median", "base_ci",
+    "new_n", "new_median", "new_ci",
+    "delta", "pvalue"])
+
+
+def median_ci(samples, confidence=0.95):
+    """
+    Distribution-free confidence interval of the median
+
+    Uses the order statistics whose ranks are given by the normal
+    approximation of the binomial distribution.
+    """
+    data = sorted(samples)
+    n = len(data)
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    lower = max(int(math.floor(n / 2 - z * math.sqrt(n) / 2)), 0)
+    upper = min(int(math.ceil(n / 2 + z * math.sqrt(n) / 2)), n - 1)
+    return data[lower], data[upper]
+
+
+def mann_whitney_u(a, b):
+    """
+    Two-sided p-value of the Mann-Whitney U test (normal approximation with
+    tie correction). Returns None if there are too few samples.
+    """
+    n1, n2 = len(a), len(b)
+    if n1 < 3 or n2 < 3:
+        return None
+    combined = sorted([(x, 0) for x in a] + [(x, 1) for x in b])
+    ranks = [0.0] * len(combined)
+    ties = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u1 - n1 * n2 / 2) - 0.5) / sigma
+    return min(1.0, 2 * (1 - statistics.NormalDist().cdf(max(z, 0))))
+
+
+def compare(store_base, filters_base, store_new, filters_new,
+            benchmark="speed", primitives=("crypto_kem", "crypto_sign"),
+            schemes=None, confidence=0.95):
+    """Compare the results of the benchmark for all common schemes and metrics"""
+    comparisons = []
+    for primitive in primitives:
+        base = store_base.measurements(benchmark, primitive, **filters_base)
+        new = store_new.measurements(benchmark, primitive, **filters_new)
+        for scheme in sorted(set(base) & set(new)):
+            if schemes and scheme not in schemes:
+                continue
+            for implementation in sorted(set(base[scheme]) & set(new[scheme])):
+                base_runs = base[scheme][implementation]
+                new_runs = new[scheme][implementation]
+                metrics = sorted({m for run in base_runs for m in run} &
+                                 {m for run in new_runs for m in run})
+                for metric in metrics:
+                    a = [run[metric] for run in base_runs if metric in run]
+                    b = [run[metric] for run in new_runs if metric in run]
+                    base_median = statistics.median(a)
+                    new_median = statistics.median(b)
+                    delta = None
+                    if base_median != 0:
+                        delta = (new_median - base_median) / base_median * 100
+                    comparisons.append(Comparison(
+                        primitive, scheme, implementation, metric,
+                        len(a), base_median, median_ci(a, confidence),
+                        len(b), new_median, median_ci(b, confidence),
+                        delta, mann_whitney_u(a, b)))
+    return comparisons
+
+
+def is_regression(comparison, threshold, alpha):
+    """Significantly larger (slower, more memory) by more than threshold percent"""
+    return (comparison.pvalue is not None and comparison.pvalue < alpha and
+            comparison.delta is not None and comparison.delta > threshold)
+
+
+def is_improvement(comparison, threshold, alpha):
+    return (comparison.pvalue is not None and comparison.pvalue < alpha and
+            comparison.delta is not None and comparison.delta < -threshold)
@@ -14,6 +14,7 @@
 #include "gf2x.h"
 #include "sampling.h"
 #include "sha.h"
+#include "profiling.h"
 
 // m_t and seed_t have the same size and thus can be considered
 // to be of the same type. However, for security reasons we distinguish
@@ -152,15 +153,21 @@ int crypto_kem_keypair(OUT unsigned char *pk, OUT unsigned char *sk)
   GUARD(init_shake256_prf_state(&h_prf_state, MAX_PRF_INVOCATION, &seeds.seed[0]));
 
   // Generate the secret key (h0, h1) with weight w/2
+  PROFILE_BEGIN(generate_sparse_rep);
   GUARD(generate_sparse_rep(&h0, l_sk.wlist[0].val, &h_prf_state));
   GUARD(generate_sparse_rep(&h1, l_sk.wlist[1].val, &h_prf_state));
+  PROFILE_END(generate_sparse_rep);
 
   // Generate sigma
   convert_seed_to_m_type(&l_sk.sigma, &seeds.seed[1]);
 
   // Calculate the public key
+  PROFILE_BEGIN(gf2x_mod_inv);
   gf2x_mod_inv(&h0inv, &h0);
+  PROFILE_END(gf2x_mod_inv);
+  PROFILE_BEGIN(gf2x_mod_mul);
   gf2x_mod_mul(&h, &h1, &h0inv);
+  PROFILE_END(gf2x_mod_mul);
 
   // Fill the secret key data structure with contents - cancel the padding
   l_sk.bin[0] = h0.val;
@@ -205,10 +212,14 @@ int crypto_kem_enc(OUT unsigned char *     ct,
 
   // e = H(m) = H(seed[0])
   convert_seed_to_m_type(&m, &seeds.seed[0]);
+  PROFILE_BEGIN(function_h);
   GUARD(function_h(&e, &m));
+  PROFILE_END(function_h);
 
   // Calculate the ciphertext
+  PROFILE_BEGIN(encrypt);
   GUARD(encrypt(&l_ct, &e, &l_pk, &m));
+  PROFILE_END(encrypt);
 
   // Generate the shared secret
   GUARD(function_k(&l_ss, &m, &l_ct));
@@ -255,7 +266,9 @@ int crypto_kem_dec(OUT unsigned char *     ss,
   memset( &e_prime, 0 , sizeof(e_prime) );
 
   // Decode and on success check if |e|=T (all in constant-time)
+  PROFILE_BEGIN(decode);
   volatile uint32_t success_cond = (decode(&e, &l_ct, &l_sk) == SUCCESS);
+  PROFILE_END(decode);
 //  success_cond &= secure_cmp32(T, r_bits_vector_weight(&e.val[0]) +
 //                                    r_bits_vector_weight(&e.val[1]));
 
@@ -270,11 +283,15 @@ int crypto_kem_dec(OUT unsigned char *     ss,
     PE1_RAW(&e_prime)[i] = E1_RAW(&e)[i];
   }
 
+  PROFILE_BEGIN(reencrypt);
   GUARD(reencrypt(&m_prime, &e_prime, &l_ct));
+  PROFILE_END(reencrypt);
 
   // Check if H(m') is equal to (e0', e1')
   // (in constant-time)
+  PROFILE_BEGIN(function_h);
   GUARD(function_h(&e_tmp, &m_prime));
+  PROFILE_END(function_h);
   success_cond = secure_cmp(PE0_RAW(&e_prime), PE0_RAW(&e_tmp), R_BYTES);
   success_cond &= secure_cmp(PE1_RAW(&e_prime), PE1_RAW(&e_tmp), R_BYTES);
 
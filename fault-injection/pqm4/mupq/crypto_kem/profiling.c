@@ -0,0 +1,128 @@
+#include "api.h"
+#include "hal.h"
+#include "sendfn.h"
+#include "profiling.h"
+
+#include <stdint.h>
+#include <string.h>
+
+// https://stackoverflow.com/a/1489985/1711232
+#define PASTER(x, y) x##y
+#define EVALUATOR(x, y) PASTER(x, y)
+#define NAMESPACE(fun) EVALUATOR(MUPQ_NAMESPACE, fun)
+
+// use different names so we can have empty namespaces
+#define MUPQ_CRYPTO_BYTES           NAMESPACE(CRYPTO_BYTES)
+#define MUPQ_CRYPTO_PUBLICKEYBYTES  NAMESPACE(CRYPTO_PUBLICKEYBYTES)
+#define MUPQ_CRYPTO_SECRETKEYBYTES  NAMESPACE(CRYPTO_SECRETKEYBYTES)
+#define MUPQ_CRYPTO_CIPHERTEXTBYTES NAMESPACE(CRYPTO_CIPHERTEXTBYTES)
+#define MUPQ_CRYPTO_ALGNAME NAMESPACE(CRYPTO_ALGNAME)
+
+#define MUPQ_crypto_kem_keypair NAMESPACE(crypto_kem_keypair)
+#define MUPQ_crypto_kem_enc NAMESPACE(crypto_kem_enc)
+#define MUPQ_crypto_kem_dec NAMESPACE(crypto_kem_dec)
+
+#define printcycles(S, U) send_unsignedll((S), (U))
+
+#define MAX_REGIONS 32
+#define MAX_LABEL 96
+
+static struct {
+  const char *name;
+  unsigned long long cycles;
+  unsigned int calls;
+} regions[MAX_REGIONS];
+static unsigned int nregions;
+
+void profile_region_add(const char *name, unsigned long long cycles)
+{
+  unsigned int i;
+  for (i = 0; i < nregions; i++) {
+    if (regions[i].name == name || strcmp(regions[i].name, name) == 0) {
+      break;
+    }
+  }
+  if (i == nregions) {
+    if (nregions == MAX_REGIONS) {
+      return;
+    }
+    regions[i].name = name;
+    regions[i].cycles = 0;
+    regions[i].calls = 0;
+    nregions++;
+  }
+  regions[i].cycles += cycles;
+  regions[i].calls += 1;
+}
+
+// Sends "<op> region <name> cycles:" and "... calls:" for every region
+// that was entered since the last report.
+static void send_regions(const char *op)
+{
+  char label[MAX_LABEL];
+  size_t oplen = strlen(op);
+  unsigned int i;
+  for (i = 0; i < nregions; i++) {
+    size_t namelen = strlen(regions[i].name);
+    if (oplen + namelen + sizeof(" region ") + sizeof(" cycles:") > MAX_LABEL) {
+      continue;
+    }
+    memcpy(label, op, oplen);
+    memcpy(label + oplen, " region ", 8);
+    memcpy(label + oplen + 8, regions[i].name, namelen);
+    strcpy(label + oplen + 8 + namelen, " cycles:");
+    printcycles(label, regions[i].cycles);
+    strcpy(label + oplen + 8 + namelen, " calls:");
+    send_unsigned(label, regions[i].calls);
+  }
+  nregions = 0;
+}
+
+int main(void)
+{
+  unsigned char key_a[MUPQ_CRYPTO_BYTES], key_b[MUPQ_CRYPTO_BYTES];
+  unsigned char sk[MUPQ_CRYPTO_SECRETKEYBYTES];
+  unsigned char pk[MUPQ_CRYPTO_PUBLICKEYBYTES];
+  unsigned char ct[MUPQ_CRYPTO_CIPHERTEXTBYTES];
+  unsigned long long t0, t1;
+  int i;
+
+  hal_setup(CLOCK_BENCHMARK);
+
+  hal_send_str("==========================");
+
+  for(i=0;i<MUPQ_ITERATIONS; i++)
+  {
+    // Key-pair generation
+    nregions = 0;
+    t0 = hal_get_time();
+    MUPQ_crypto_kem_keypair(pk, sk);
+    t1 = hal_get_time();
+    printcycles("keypair cycles:", t1-t0);
+    send_regions("keypair");
+
+    // Encapsulation
+    t0 = hal_get_time();
+    MUPQ_crypto_kem_enc(ct, key_a, pk);
+    t1 = hal_get_time();
+    printcycles("encaps cycles:", t1-t0);
+    send_regions("encaps");
+
+    // Decapsulation
+    t0 = hal_get_time();
+    MUPQ_crypto_kem_dec(key_b, ct, sk);
+    t1 = hal_get_time();
+    printcycles("decaps cycles:", t1-t0);
+    send_regions("decaps");
+
+    if (memcmp(key_a, key_b, MUPQ_CRYPTO_BYTES)) {
+      hal_send_str("ERROR KEYS\n");
+    }
+    else {
+      hal_send_str("OK KEYS\n");
+    }
+    hal_send_str("+");
+  }
+  hal_send_str("#");
+  return 0;
+}
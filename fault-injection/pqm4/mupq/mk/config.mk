@@ -85,6 +85,7 @@ LDFLAGS += -flto
 endif
 
 CPPFLAGS += -DMUPQ -DMUPQ_NAMESPACE=$(MUPQ_NAMESPACE) -DMUPQ_ITERATIONS=$(MUPQ_ITERATIONS)
+CPPFLAGS += $(if $(PROFILE_REGIONS),-DPROFILE_REGIONS)
 
 CFLAGS += \
 	-Wall -Wextra -Wshadow \
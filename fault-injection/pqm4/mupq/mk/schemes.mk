@@ -94,6 +94,7 @@ libs: obj/lib$(2).a
 elf/$(2)_%.elf: CPPFLAGS+=-I$(1)
 elf/$(2)_%.elf: MUPQ_NAMESPACE=$(call namespace,$(2),$(3))
 elf/$(2)_%.elf: PROFILE_HASHING=$$(filter %_hashing.elf,$$@)
+elf/$(2)_%.elf: PROFILE_REGIONS=$$(filter %_profiling.elf,$$@)
 elf/$(2)_%.elf: NO_RANDOMBYTES=$$(filter %_testvectors.elf,$$@)
 elf/$(2)_%.elf: NIST_KAT_RANDOMBYTES=$$(filter %_kat.elf, $$@)
 
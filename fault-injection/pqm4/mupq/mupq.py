@@ -1,6 +1,8 @@
 import abc
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+import concurrent.futures
 import contextlib
+import json
 import re
 import os
 import os.path
@@ -10,11 +12,16 @@ import subprocess
 import hashlib
 import time
 import statistics
-from datetime import datetime
 import tqdm
 import sys
+import threading
 import traceback
 
+from mupq import compare
+from mupq import genskiplist
+from mupq import results
+from mupq import trace
+
 class TqdmLoggingHandler(logging.StreamHandler):
     def __init__(self, tqdm_class=tqdm.std.tqdm):
         super(TqdmLoggingHandler, self).__init__()
@@ -30,22 +37,48 @@ class TqdmLoggingHandler(logging.StreamHandler):
         except:
             self.handleError(record)
 
-formater = logging.Formatter("%(asctime)s %(name)s %(levelname)s: %(message)s")
-stream_handler = TqdmLoggingHandler()
-stream_handler.setLevel(logging.WARNING)
-stream_handler.setFormatter(formater)
 LOGFILE = "mupq.log"
-file_handler = logging.handlers.RotatingFileHandler(LOGFILE, backupCount=10)
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formater)
-if os.path.isfile(LOGFILE):
-    file_handler.doRollover()
 
-logging.basicConfig(level=logging.DEBUG, handlers=[stream_handler, file_handler], force=True)
+_logging_lock = threading.Lock()
+_logging_ready = False
+
+
+def setup_logging():
+    """
+    Log warnings to the console and everything to mupq.log, the logs of the
+    previous sessions are rotated
+
+    Called when the harness is first used (settings or platform created), so
+    importing mupq does not touch the log files.
+    """
+    global _logging_ready
+    with _logging_lock:
+        if _logging_ready:
+            return
+        formater = logging.Formatter("%(asctime)s %(name)s %(levelname)s: %(message)s")
+        stream_handler = TqdmLoggingHandler()
+        stream_handler.setLevel(logging.WARNING)
+        stream_handler.setFormatter(formater)
+        file_handler = logging.handlers.RotatingFileHandler(LOGFILE, backupCount=10)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formater)
+        if os.path.isfile(LOGFILE):
+            file_handler.doRollover()
+        logging.basicConfig(level=logging.DEBUG, handlers=[stream_handler, file_handler], force=True)
+        _logging_ready = True
+
+MakeResult = namedtuple("MakeResult", ["target", "returncode", "duration", "logfile"])
+
 
 class Implementation(object):
     """Contains some properties of a scheme implementation"""
 
+    #: folder the output of every make invocation is written to
+    make_logdir = "obj/log"
+
+    #: number of stdout and stderr lines repeated in the log when make fails
+    make_tail = 50
+
     #: regex to parse the paths into schemes
     _path_regex = re.compile(
         r'(?P<project>\S+/)?'
@@ -69,6 +102,8 @@ class Implementation(object):
         else:
             self.namespace = f"{namespace}_{scheme.replace('-','').upper()}_{implementation.upper()}_"
         self.extraflags = extraflags
+        #: MakeResult of the last make invocation per target
+        self.make_results = dict()
 
     @classmethod
     def from_path(cls, project, path, namespace, extraflags=[]):
@@ -86,25 +121,57 @@ class Implementation(object):
                    matches.group("implementation"),
                    path, namespace, extraflags)
 
-    def run_make(self, target):
-        makeflags = ["make",
-                     f"IMPLEMENTATION_PATH={self.path}"]
+    def get_makeflags(self):
+        makeflags = [f"IMPLEMENTATION_PATH={self.path}"]
         if self.namespace is not None:
             makeflags.append(f"MUPQ_NAMESPACE={self.namespace}")
         makeflags.extend(self.extraflags)
+        return makeflags
+
+    def _pump_make_output(self, pipe, name, level, lines, logfile, loglock):
+        """Forward the lines of one make output pipe while make is running"""
+        for line in iter(pipe.readline, b''):
+            line = line.decode("utf8", "replace").rstrip("\n")
+            with loglock:
+                logfile.write(f"{name}: {line}\n")
+            lines.append(line)
+            self.log.log(level, "make %s: %s", name, line)
+        pipe.close()
+
+    def run_make(self, target):
+        makeflags = ["make"] + self.get_makeflags()
         makeflags.append(target)
-        p = subprocess.Popen(makeflags, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        ret = p.wait()
-        stdout = p.stdout.read()
-        stderr = p.stdout.read()
-        if len(stdout) > 0:
-            self.log.log(logging.ERROR if ret else logging.DEBUG,
-                         "make stdout output:\n" + stdout.decode("utf8").strip())
-        if len(stderr) > 0:
-            self.log.log(logging.ERROR if ret else logging.WARNING,
-                         "make stderr output:\n" + stderr.decode("utf8").strip())
+        os.makedirs(self.make_logdir, exist_ok=True)
+        logpath = os.path.join(self.make_logdir, target.replace("/", "_") + ".log")
+        stdout = deque(maxlen=self.make_tail)
+        stderr = deque(maxlen=self.make_tail)
+        loglock = threading.Lock()
+        start = time.monotonic()
+        with open(logpath, "w") as logfile:
+            logfile.write(" ".join(makeflags) + "\n")
+            # Both pipes are drained while make runs, otherwise make blocks
+            # as soon as one of the pipe buffers is full.
+            p = subprocess.Popen(makeflags, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            readers = [
+                threading.Thread(target=self._pump_make_output,
+                                 args=(p.stdout, "stdout", logging.DEBUG, stdout, logfile, loglock)),
+                threading.Thread(target=self._pump_make_output,
+                                 args=(p.stderr, "stderr", logging.WARNING, stderr, logfile, loglock)),
+            ]
+            for reader in readers:
+                reader.start()
+            ret = p.wait()
+            for reader in readers:
+                reader.join()
+            duration = time.monotonic() - start
+            logfile.write(f"return code {ret} after {duration:.2f}s\n")
+        self.make_results[target] = MakeResult(target, ret, duration, logpath)
+        trace.tracer.add("make", target, start, duration, returncode=ret)
         if ret:
-            self.log.error("make return code %d", ret)
+            self.log.error("make %s return code %d, full output in %s\n%s",
+                           target, ret, logpath, "\n".join(list(stdout) + list(stderr)))
+        else:
+            self.log.debug("make %s finished in %.2fs", target, duration)
         return ret
 
     def get_binary_path(self, test_type, bin_type=None):
@@ -131,6 +198,249 @@ class Implementation(object):
         return f"{self.scheme} - {self.implementation}"
 
 
+BuildResult = namedtuple("BuildResult", ["implementation", "test_type", "target", "returncode", "duration", "skipped"])
+
+
+class BuildCache(object):
+    """
+    Remembers the input hash of every binary that was built successfully
+
+    The hash covers the sources of the implementation, the shared sources and
+    makefiles, the linker scripts, libopencm3, the test program and the make
+    flags. A binary whose inputs did not change is not handed to make again,
+    even if a shared file was touched. Object files and archives that make
+    leaves in these folders (libopencm3 builds in-tree) are not hashed.
+    """
+
+    #: file the hashes are stored in, removed together with obj/ by make clean
+    cachefile = "obj/.buildcache.json"
+
+    #: files and folders every binary depends on
+    shared_files = ["Makefile"]
+    shared_folders = ["common", "mupq/common", "mk", "mupq/mk", "ldscripts", "libopencm3",
+                      "mupq/pqclean/common", "mupq/pqclean/test/common"]
+
+    #: build outputs inside the hashed folders
+    generated_suffixes = (".o", ".d", ".a")
+
+    def __init__(self, cachefile=None):
+        self.log = logging.getLogger(__class__.__name__)
+        if cachefile is not None:
+            self.cachefile = cachefile
+        self.lock = threading.Lock()
+        self._shared_hash = None
+        try:
+            with open(self.cachefile, "r") as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = dict()
+
+    @staticmethod
+    def _hash_file(hash, path):
+        if not os.path.isfile(path):
+            # e.g., dangling links into missing submodules
+            return
+        hash.update(path.encode("utf8"))
+        with open(path, "rb") as f:
+            hash.update(f.read())
+
+    @classmethod
+    def _hash_folder(cls, hash, folder):
+        # implementations share sources through symlinked folders
+        for root, dirs, files in os.walk(folder, followlinks=True):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith(cls.generated_suffixes):
+                    cls._hash_file(hash, os.path.join(root, name))
+
+    def shared_hash(self):
+        """Hash of the shared folders, computed once per cache"""
+        with self.lock:
+            if self._shared_hash is None:
+                hash = hashlib.sha256()
+                for path in self.shared_files:
+                    self._hash_file(hash, path)
+                for folder in self.shared_folders:
+                    self._hash_folder(hash, folder)
+                self._shared_hash = hash.hexdigest()
+            return self._shared_hash
+
+    def input_hash(self, implementation, test_type):
+        hash = hashlib.sha256(self.shared_hash().encode("ascii"))
+        hash.update(" ".join(implementation.get_makeflags()).encode("utf8"))
+        hash.update(test_type.encode("utf8"))
+        self._hash_folder(hash, implementation.path)
+        self._hash_file(hash, f"mupq/{implementation.primitive}/{test_type}.c")
+        return hash.hexdigest()
+
+    def is_fresh(self, target, digest):
+        with self.lock:
+            return self.hashes.get(target) == digest and os.path.isfile(target)
+
+    def update(self, target, digest):
+        with self.lock:
+            self.hashes[target] = digest
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+            with open(self.cachefile, "w") as f:
+                json.dump(self.hashes, f, indent=0, sort_keys=True)
+
+
+class BuildScheduler(object):
+    """
+    Builds the binaries of many implementations on a bounded pool of workers
+
+    Binaries whose inputs did not change since the last successful build are
+    skipped (see BuildCache). The build time of every target is recorded in
+    `results` and summarized by `report`.
+    """
+
+    def __init__(self, settings, jobs=None, cache=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.platform_settings = settings
+        if jobs is None:
+            jobs = getattr(settings, "build_jobs", None) or os.cpu_count() or 1
+        self.jobs = max(1, jobs)
+        self.cache = BuildCache() if cache is None else cache
+        self.results = []
+
+    def _build(self, implementation, test_type):
+        target = implementation.get_binary_path(test_type,
+                                                self.platform_settings.binary_type)
+        digest = self.cache.input_hash(implementation, test_type)
+        if self.cache.is_fresh(target, digest):
+            self.log.info("Skipping %s - %s, inputs unchanged", implementation, test_type)
+            return BuildResult(implementation, test_type, target, 0, 0.0, True)
+        self.log.info("Building %s - %s", implementation, test_type)
+        ret = implementation.run_make(target)
+        if ret == 0:
+            self.cache.update(target, digest)
+        duration = implementation.make_results[target].duration
+        return BuildResult(implementation, test_type, target, ret, duration, False)
+
+    def build(self, builds):
+        """
+        Build a list of (implementation, test_type) tuples
+
+        The first build runs alone, as it also builds the libraries shared by
+        all binaries (hal, symmetric crypto) which must not be written by
+        several make processes at once.
+        """
+        builds = list(builds)
+        results = []
+        with tqdm.tqdm(total=len(builds), desc="Building") as pb:
+            def done(result):
+                results.append(result)
+                if result.returncode:
+                    pb.write(f"{result.implementation} - {result.test_type} FAILED")
+                pb.update()
+
+            if len(builds) > 0:
+                done(self._build(*builds[0]))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = [pool.submit(self._build, *b) for b in builds[1:]]
+                for future in concurrent.futures.as_completed(futures):
+                    done(future.result())
+        self.cache.save()
+        self.results.extend(results)
+        return results
+
+    def report(self, top=10):
+        """Print the number of built and skipped targets and the slowest ones"""
+        built = [r for r in self.results if not r.skipped]
+        skipped = len(self.results) - len(built)
+        failed = [r for r in built if r.returncode]
+        total = sum(r.duration for r in built)
+        tqdm.tqdm.write(f"Built {len(built)} targets ({len(failed)} failed), "
+                        f"skipped {skipped} unchanged, {total:.1f}s build time "
+                        f"on {self.jobs} workers")
+        for r in sorted(built, key=lambda r: r.duration, reverse=True)[:top]:
+            tqdm.tqdm.write(f"{r.duration:8.1f}s  {r.target}")
+        return len(failed)
+
+
+class ImplementationIndex(object):
+    """
+    All implementations in a list of scheme folders, looked up by scheme,
+    primitive and implementation name
+
+    The folders are listed once. The index is rebuilt when the mtime of a
+    scheme folder or of the folder of a scheme changes, i.e., when a scheme
+    or an implementation was added or removed.
+    """
+
+    #: implementations for other architectures
+    ignored = ["avx", "avx2", "aesni", "sse", "aarch64"]
+
+    def __init__(self, scheme_folders, makeflags):
+        self.scheme_folders = list(scheme_folders)
+        self.makeflags = makeflags
+        self.lock = threading.Lock()
+        self.implementations = []
+        self._by_scheme = dict()
+        self._mtimes = None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _stale(self):
+        return (self._mtimes is None or
+                any(self._mtime(path) != mtime for path, mtime in self._mtimes.items()))
+
+    def _build(self):
+        mtimes = dict()
+        implementations = []
+        for parent, folder, namespace in self.scheme_folders:
+            mtimes[folder] = self._mtime(folder)
+            if mtimes[folder] is None:
+                # e.g., a submodule that is not checked out
+                continue
+            primitive = os.path.basename(folder)
+            for scheme in sorted(os.listdir(folder)):
+                scheme_path = os.path.join(folder, scheme)
+                if not os.path.isdir(scheme_path):
+                    continue
+                mtimes[scheme_path] = self._mtime(scheme_path)
+                for name in sorted(os.listdir(scheme_path)):
+                    path = os.path.join(scheme_path, name)
+                    if name in self.ignored or not os.path.isdir(path):
+                        continue
+                    implementations.append(Implementation(
+                        parent, primitive, scheme, name, path, namespace, self.makeflags))
+        by_scheme = defaultdict(list)
+        for implementation in implementations:
+            by_scheme[implementation.scheme].append(implementation)
+        self.implementations = implementations
+        self._by_scheme = dict(by_scheme)
+        self._mtimes = mtimes
+
+    def select(self, schemes=None, primitives=None, implementations=None, exclude=False):
+        """
+        The implementations of the given schemes, primitives and implementation
+        names (None for all). With exclude=True the given schemes are left out
+        instead.
+        """
+        with self.lock:
+            if self._stale():
+                self._build()
+            if schemes and not exclude:
+                selected = [impl for scheme in dict.fromkeys(schemes)
+                            for impl in self._by_scheme.get(scheme, [])]
+            else:
+                selected = self.implementations
+            excluded = set(schemes) if schemes and exclude else set()
+            return [impl for impl in selected
+                    if impl.scheme not in excluded
+                    and (not primitives or impl.primitive in primitives)
+                    and (not implementations or impl.implementation in implementations)]
+
+
 class PlatformSettings(object):
     """Contains the settings for a certain platform"""
     scheme_folders = [
@@ -145,53 +455,91 @@ class PlatformSettings(object):
 
     binary_type = 'bin'
 
+    #: number of concurrent builds, None for one per core
+    build_jobs = None
+
+    #: rerun speed benchmarks until the confidence interval of the median of
+    #: every operation is within this fraction of the median, None to run once
+    target_ci = None
+
+    #: maximum time in seconds spent on the reruns of one implementation
+    time_budget = None
+
+    _index = None
+    _skip_index = None
+    _skip_key = None
+
     def __init__(self):
+        setup_logging()
         self.log = logging.getLogger(__class__.__name__)
 
     def __str__(self):
         return self.name
 
-    def get_implementations(self, all=False):
-        """Get the schemes"""
-        try:
-            for (parent, scheme_folder, namespace) in self.scheme_folders:
-                for scheme in os.listdir(scheme_folder):
-                    scheme_path = os.path.join(scheme_folder, scheme)
-                    if not os.path.isdir(scheme_path):
-                        continue
-                    for implementation_path in os.listdir(scheme_path):
-                        if implementation_path in ["avx", "avx2", "aesni", "sse", "aarch64"]:
-                            continue
-                        path = os.path.join(scheme_path,
-                                            implementation_path)
-                        if not os.path.isdir(path):
-                            continue
-                        impl = Implementation.from_path(parent, path, namespace, self.makeflags)
-                        if not all and self.should_skip(impl):
-                            continue
-                        yield impl
-        except FileNotFoundError as e:
-            raise Exception(
-                "There is no bin/ folder. Please first make binaries."
-            ) from e
+    def optflags(self):
+        """The make flags that change the generated code, e.g., for comparing results"""
+        return " ".join(flag for flag in self.makeflags
+                        if not flag.startswith(("PLATFORM=", "MUPQ_ITERATIONS="))
+                        and not flag.endswith("="))
+
+    def implementation_index(self):
+        """The ImplementationIndex of the scheme folders, created on first use"""
+        if self._index is None or self._index.makeflags != self.makeflags:
+            self._index = ImplementationIndex(self.scheme_folders, self.makeflags)
+        return self._index
+
+    def get_implementations(self, all=False, **filters):
+        """Get the schemes, filtered as in ImplementationIndex.select"""
+        # rebuilt once per call, so in-place edits of skip_list are always seen
+        rules = None if all else self._skip_rules(refresh=True)
+        for impl in self.implementation_index().select(**filters):
+            if not all and self._matches(impl, rules):
+                continue
+            yield impl
 
-    def should_skip(self, impl):
-        """Should this Implementation be skipped?"""
-        for item in self.skip_list:
-            match = len(item) > 0
-            for attribute, value in item.items():
-                if getattr(impl, attribute) != value:
-                    match = False
-            if match:
+    def _skip_rules(self, refresh=False):
+        """
+        skip_list as {attribute names: set of value tuples}
+
+        The rules are cached by the identity and length of skip_list; an
+        in-place edit that keeps the length is only picked up with refresh.
+        """
+        key = (id(self.skip_list), len(self.skip_list))
+        if refresh or self._skip_key != key:
+            rules = defaultdict(set)
+            for item in self.skip_list:
+                # an empty rule matches nothing
+                if len(item) == 0:
+                    continue
+                attributes = tuple(sorted(item))
+                rules[attributes].add(tuple(item[a] for a in attributes))
+            self._skip_index = rules
+            self._skip_key = key
+        return self._skip_index
+
+    @staticmethod
+    def _matches(impl, rules):
+        for attributes, values in rules.items():
+            if tuple(getattr(impl, a) for a in attributes) in values:
                 return True
         return False
 
+    def should_skip(self, impl):
+        """Should this Implementation be skipped?"""
+        return self._matches(impl, self._skip_rules())
+
 
 class Platform(contextlib.AbstractContextManager):
     """Generic platform interface"""
 
     def __init__(self):
+        setup_logging()
         self.log = logging.getLogger(__class__.__name__)
+        #: SHA-256 of the image on the target, None if unknown
+        self.flashed = None
+        #: seconds spent flashing and running in the last call of run()
+        self.flash_time = None
+        self.run_time = None
 
     def __enter__(self):
         return super().__enter__()
@@ -202,12 +550,157 @@ class Platform(contextlib.AbstractContextManager):
     def device(self):
         raise NotImplementedError("Override this")
 
+    def flash(self, binary_path):
+        raise NotImplementedError("Override this")
+
+    def load(self, binary_path, flash=True):
+        """
+        Flashes the binary unless the same image is already on the target
+
+        Returns True if it was flashed, otherwise the caller has to restart the
+        target. With flash=False the check is skipped and nothing is flashed.
+        """
+        start = time.monotonic()
+        self.flash_time = 0.0
+        if not flash:
+            return False
+        with open(binary_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest == self.flashed:
+            self.log.debug("%s is already flashed", binary_path)
+            return False
+        # an interrupted flash leaves an unknown image behind
+        self.flashed = None
+        with trace.span("flash", binary_path):
+            self.flash(binary_path)
+        self.flashed = digest
+        self.flash_time = time.monotonic() - start
+        return True
+
     @abc.abstractmethod
-    def run(self, binary_path):
-        """Runs the flashed target and collects the result"""
+    def run(self, binary_path, expiterations=1, flash=True, sink=None):
+        """
+        Runs the target and collects the result
+
+        The binary is only flashed if it is not on the target yet (see load),
+        with flash=False it is restarted without checking. If sink is given,
+        the output is passed to sink(bytes) as it arrives and not returned.
+        """
         raise NotImplementedError("Override this")
 
 
+class PlatformPool(contextlib.AbstractContextManager):
+    """
+    A set of identical platforms (boards or emulators) tests are spread over
+
+    Entering the pool enters all of its platforms.
+    """
+
+    def __init__(self, platforms):
+        self.platforms = list(platforms)
+        self._stack = contextlib.ExitStack()
+
+    def __len__(self):
+        return len(self.platforms)
+
+    def __iter__(self):
+        return iter(self.platforms)
+
+    def __enter__(self):
+        for platform in self.platforms:
+            self._stack.enter_context(platform)
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        return self._stack.__exit__(*args, **kwargs)
+
+
+class RuntimeHistory(object):
+    """Moving average of the runtime of every test, used to start slow tests first"""
+
+    #: file the runtimes are stored in
+    historyfile = "obj/.runtimes.json"
+
+    #: weight of the most recent runtime in the moving average
+    weight = 0.5
+
+    def __init__(self, historyfile=None):
+        if historyfile is not None:
+            self.historyfile = historyfile
+        self.lock = threading.Lock()
+        try:
+            with open(self.historyfile, "r") as f:
+                self.runtimes = json.load(f)
+        except (OSError, ValueError):
+            self.runtimes = dict()
+
+    @staticmethod
+    def _key(implementation, test_type):
+        return f"{test_type}:{implementation.path}"
+
+    def get(self, implementation, test_type, default=None):
+        with self.lock:
+            return self.runtimes.get(self._key(implementation, test_type), default)
+
+    def update(self, implementation, test_type, runtime):
+        key = self._key(implementation, test_type)
+        with self.lock:
+            if key in self.runtimes:
+                runtime = self.weight * runtime + (1 - self.weight) * self.runtimes[key]
+            self.runtimes[key] = runtime
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.historyfile), exist_ok=True)
+            with open(self.historyfile, "w") as f:
+                json.dump(self.runtimes, f, indent=0, sort_keys=True)
+
+
+class SkipListCache(object):
+    """
+    Measured memory estimates of the implementations, per set of optimization
+    flags, together with the input hash they were measured for
+    """
+
+    #: kept next to the static skiplist.py, it is not a build artifact
+    cachefile = "skiplist.json"
+
+    def __init__(self, cachefile=None):
+        if cachefile is not None:
+            self.cachefile = cachefile
+        self.lock = threading.Lock()
+        try:
+            with open(self.cachefile, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = dict()
+
+    @staticmethod
+    def _key(implementation):
+        return f"{implementation.scheme}/{implementation.implementation}"
+
+    def is_fresh(self, implementation, optflags, digest):
+        with self.lock:
+            entry = self.entries.get(optflags, {}).get(self._key(implementation))
+            return entry is not None and entry["inputs"] == digest
+
+    def update(self, implementation, optflags, digest, estmemory, flashsize):
+        with self.lock:
+            self.entries.setdefault(optflags, {})[self._key(implementation)] = {
+                "estmemory": estmemory, "flashsize": flashsize, "inputs": digest}
+
+    def estimates(self, optflags):
+        """{(scheme, implementation): estmemory} measured with optflags"""
+        with self.lock:
+            return {tuple(key.split("/", 1)): entry["estmemory"]
+                    for key, entry in self.entries.get(optflags, {}).items()}
+
+    def save(self):
+        with self.lock:
+            with open(self.cachefile, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
 class BoardTestCase(abc.ABC):
     """
     Generic test class to run tests on all schemes.
@@ -220,45 +713,123 @@ class BoardTestCase(abc.ABC):
     iterations = 1
 
     def __init__(self, settings, interface):
+        setup_logging()
         self.platform_settings = settings
         self.interface = interface
         self.log = logging.getLogger(__class__.__name__)
-
-    def get_implementations(self, all=False):
-        return self.platform_settings.get_implementations(all)
+        self.history = RuntimeHistory()
+        self._worker = threading.local()
+        # binaries the prebuild left up to date, (implementation path, test type)
+        self._prebuilt = set()
+
+    def get_implementations(self, all=False, **filters):
+        return self.platform_settings.get_implementations(all, **filters)
+
+    def current_platform(self):
+        """The platform the calling worker thread runs its tests on"""
+        return getattr(self._worker, "platform", self.interface)
+
+    def get_pool(self):
+        if isinstance(self.interface, PlatformPool):
+            return self.interface
+        return PlatformPool([self.interface])
+
+    def prebuild(self, implementations):
+        """Build all binaries up front, so the boards do not wait for make"""
+        scheduler = BuildScheduler(self.platform_settings)
+        results = scheduler.build((implementation, self.test_type)
+                                  for implementation in implementations)
+        self._prebuilt.update((r.implementation.path, r.test_type)
+                              for r in results if r.returncode == 0)
+
+    def build_binary(self, implementation, test_type):
+        """Build a binary for a test, unless the prebuild already did"""
+        if (implementation.path, test_type) in self._prebuilt:
+            return
+        implementation.build_binary(test_type, self.platform_settings.binary_type)
 
     @abc.abstractmethod
-    def run_test(self, implementation):
+    def run_test(self, implementation, sink=None):
         self.log.info("Runnning %s - %s", implementation, self.test_type)
-        implementation.build_binary(f'{self.test_type}',
-                                    self.platform_settings.binary_type)
+        self.build_binary(implementation, self.test_type)
         binary = implementation.get_binary_path(f'{self.test_type}',
                                                 self.platform_settings.binary_type)
         try:
-            output = self.interface.run(binary, self.iterations)
+            output = self.current_platform().run(binary, self.iterations, sink=sink)
             return output
         except Exception as e:
             tb = "\n".join(traceback.format_exception(e))
             self.log.error("Running %s - %s failed with exception: %s", implementation, self.test_type, tb)
             return -1
 
-    def test_all(self, args=[]):
-        implementations = []
+    def select_implementations(self, args=[]):
+        """Implementations selected by the scheme names (or --exclude) in args"""
         exclude = "--exclude" in args
-        for implementation in self.get_implementations():
-            if exclude and implementation.scheme in args:
-                continue
-            if not exclude and len(args) > 0 and implementation.scheme not in args:
-                continue
-            implementations.append(implementation)
-        with tqdm.tqdm(total=len(implementations), desc=self.test_type) as pb:
-            for implementation in implementations:
-                pb.set_postfix_str(f"{implementation}")
-                if self.run_test(implementation) == -1:
-                    pb.write(f"{implementation} FAILED")
-                    return -1
-                pb.write(f"{implementation} SUCCESSFUL")
-                pb.update()
+        schemes = [arg for arg in args if arg != "--exclude"]
+        return list(self.get_implementations(schemes=schemes, exclude=exclude))
+
+    def run_all(self, implementations):
+        """
+        Run the test for all implementations on all platforms of the pool
+
+        Every platform gets its own worker thread, which takes the next
+        implementation from a queue that is ordered by the historical runtime
+        (slowest, or unknown, first). Failed tests do not stop the others; a
+        summary is printed at the end.
+        """
+        pool = self.get_pool()
+        if len(pool) > 1:
+            self.prebuild(implementations)
+        pending = deque(sorted(implementations,
+                               key=lambda impl: self.history.get(impl, self.test_type, float("inf")),
+                               reverse=True))
+        failed = []
+        lock = threading.Lock()
+
+        with tqdm.tqdm(total=len(pending), desc=self.test_type) as pb:
+            def worker(platform):
+                self._worker.platform = platform
+                while True:
+                    with lock:
+                        if len(pending) == 0:
+                            return
+                        implementation = pending.popleft()
+                        pb.set_postfix_str(f"{implementation}")
+                    start = time.monotonic()
+                    try:
+                        ok = self.run_test(implementation) != -1
+                    except Exception as e:
+                        tb = "\n".join(traceback.format_exception(e))
+                        self.log.error("Test %s - %s raised: %s", implementation, self.test_type, tb)
+                        ok = False
+                    self.history.update(implementation, self.test_type, time.monotonic() - start)
+                    trace.tracer.add("test", f"{implementation} - {self.test_type}",
+                                     start, time.monotonic() - start, ok=ok)
+                    with lock:
+                        if ok:
+                            pb.write(f"{implementation} SUCCESSFUL")
+                        else:
+                            failed.append(implementation)
+                            pb.write(f"{implementation} FAILED")
+                        pb.update()
+
+            workers = [threading.Thread(target=worker, args=(platform,)) for platform in pool]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        self.history.save()
+
+        if len(pool) > 1 or failed:
+            tqdm.tqdm.write(f"{self.test_type}: {len(implementations) - len(failed)} successful, "
+                            f"{len(failed)} failed on {len(pool)} platforms")
+            for implementation in failed:
+                tqdm.tqdm.write(f"  FAILED {implementation}")
+        if failed:
+            return -1
+
+    def test_all(self, args=[]):
+        return self.run_all(self.select_implementations(args))
 
 
 class SimpleTest(BoardTestCase):
@@ -278,32 +849,23 @@ class SimpleTest(BoardTestCase):
 class StackBenchmark(BoardTestCase):
     test_type = 'stack'
 
-    def write_result(self, implementation, result):
-        timestamp = datetime.fromtimestamp(
-            time.time()).strftime('%Y%m%d%H%M%S')
-        filename = os.path.join(
-            'benchmarks/',
-            self.test_type, implementation.primitive,
-            implementation.scheme, implementation.implementation,
-            timestamp)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-        # if result contains multiple iterations, they are separated by +
-        if "+" in result:
-            results = result.split("+")[:-1]
-            for idx, result in enumerate(results):
-                with open(f"{filename}_{idx}", 'w') as f:
-                    f.write(result)
-        else:
-            with open(filename, 'w') as f:
-                f.write(result)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.results = results.ResultStore()
+
+    def write_result(self, implementation, result, flash_time=None, run_time=None):
+        self.results.add_run(self.test_type, implementation, result,
+                             self.platform_settings.name,
+                             self.platform_settings.optflags(),
+                             flash_time, run_time)
 
     def run_test(self, implementation):
         self.log.info("Benchmarking %s", implementation)
         output = super().run_test(implementation)
         if output == -1:
             return -1
-        self.write_result(implementation, output)
+        platform = self.current_platform()
+        self.write_result(implementation, output, platform.flash_time, platform.run_time)
         if "ERROR" in output:
             return -1
         else:
@@ -313,16 +875,88 @@ class StackBenchmark(BoardTestCase):
 class SpeedBenchmark(StackBenchmark):
     test_type = 'speed'
 
+    #: fewer samples do not give a meaningful confidence interval
+    min_samples = 10
+    confidence = 0.95
+
     def __init__(self, *args, **kwargs):
         super(SpeedBenchmark, self).__init__(*args, **kwargs)
         self.iterations = self.platform_settings.iterations
 
+    def relative_ci(self, samples):
+        """Half width of the confidence interval of the median relative to it"""
+        if len(samples) < self.min_samples:
+            return float("inf")
+        lower, upper = compare.median_ci(samples, self.confidence)
+        median = statistics.median(samples)
+        return (upper - lower) / 2 / median if median else 0.0
+
+    def run_test(self, implementation):
+        target = self.platform_settings.target_ci
+        if target is None:
+            return super().run_test(implementation)
+        budget = self.platform_settings.time_budget
+        self.log.info("Benchmarking %s until the CI is within %.2f%%", implementation, target * 100)
+        self.build_binary(implementation, self.test_type)
+        binary = implementation.get_binary_path(self.test_type, self.platform_settings.binary_type)
+        platform = self.current_platform()
+        start = time.monotonic()
+        outputs = []
+        samples = defaultdict(list)
+        flash_time = run_time = 0.0
+        while True:
+            try:
+                # the binary stays on the target, later rounds only restart it
+                output = platform.run(binary, self.iterations, flash=len(outputs) == 0)
+            except Exception as e:
+                tb = "\n".join(traceback.format_exception(e))
+                self.log.error("Running %s - %s failed with exception: %s", implementation, self.test_type, tb)
+                return -1
+            outputs.append(output)
+            flash_time += platform.flash_time or 0.0
+            run_time += platform.run_time or 0.0
+            if "ERROR" in output:
+                break
+            for metrics in results.parse_output(output):
+                for metric, value in metrics:
+                    if metric.endswith(" cycles"):
+                        samples[metric].append(value)
+            widest = max((self.relative_ci(v) for v in samples.values()), default=float("inf"))
+            if widest <= target:
+                self.log.info("%s: CI within %.2f%% after %d runs", implementation, widest * 100, len(outputs))
+                break
+            if budget is not None and time.monotonic() - start >= budget:
+                self.log.warning("%s: time budget exhausted after %d runs, CI is %.2f%%",
+                                 implementation, len(outputs), widest * 100)
+                break
+        output = "".join(outputs)
+        self.write_result(implementation, output, flash_time, run_time)
+        return -1 if "ERROR" in output else 0
+
 class HashingBenchmark(StackBenchmark):
     test_type = 'hashing'
 
+class ProfilingBenchmark(StackBenchmark):
+    """
+    Cycles spent in the named regions (see mupq/common/profiling.h) of each
+    operation. Only KEMs have a profiling binary.
+    """
+    test_type = 'profiling'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.iterations = self.platform_settings.iterations
+
+    def get_implementations(self, all=False, **filters):
+        filters["primitives"] = ["crypto_kem"]
+        return super().get_implementations(all, **filters)
+
 class SizeBenchmark(StackBenchmark):
     test_type = 'size'
 
+    def prebuild(self, implementations):
+        pass
+
     def run_test(self, implementation):
         self.log.info("Measuring %s", implementation)
         implementation.build_library()
@@ -339,27 +973,171 @@ class SizeBenchmark(StackBenchmark):
         super().write_result(implementation, fsizes)
 
 
+class StrippedHash(object):
+    """
+    SHA3-256 of a byte stream without leading and trailing whitespace
+
+    Gives the same digest as hashing the stripped output at once, but the
+    output can be fed in chunks as it arrives.
+    """
+
+    def __init__(self):
+        self.hash = hashlib.sha3_256()
+        self.started = False
+        # trailing whitespace is only hashed once more output follows
+        self.pending = bytearray()
+
+    def update(self, data):
+        if not self.started:
+            data = data.lstrip()
+            if not data:
+                return
+            self.started = True
+        stripped = data.rstrip()
+        if stripped:
+            self.hash.update(self.pending)
+            self.pending.clear()
+            self.hash.update(stripped)
+        self.pending += data[len(stripped):]
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class StreamSearch(object):
+    """Whether a byte string occurs in output that is fed in chunks"""
+
+    def __init__(self, needle):
+        self.needle = needle
+        self.found = False
+        # the end of the previous chunk, for matches across chunk boundaries
+        self.tail = b""
+
+    def update(self, data):
+        if self.found:
+            return
+        window = self.tail + bytes(data)
+        self.found = self.needle in window
+        self.tail = window[-(len(self.needle) - 1):]
+
+
+class SkipListUpdate(BoardTestCase):
+    """
+    Measures the flash and memory usage of the stack binaries (on the
+    emulator) and stores the estimates in a SkipListCache
+
+    Implementations whose inputs did not change since they were measured with
+    the same optimization flags are not run again.
+    """
+    test_type = 'stack'
+
+    #: failed or crashed runs are assumed to need all memory of the emulator
+    failed_memory = 4096 * 1024
+
+    def __init__(self, settings, interface, margin=32, round=1024, cache=None):
+        super().__init__(settings, interface)
+        self.margin = margin
+        self.round = round
+        self.cache = SkipListCache() if cache is None else cache
+        self.buildcache = BuildCache()
+        self.optflags = settings.optflags()
+
+    def get_implementations(self, all=False, **filters):
+        # the implementations skipped today are the ones to measure
+        return super().get_implementations(True, **filters)
+
+    def run_test(self, implementation):
+        self.log.info("Measuring %s", implementation)
+        digest = self.buildcache.input_hash(implementation, self.test_type)
+        output = super().run_test(implementation)
+        if output == -1:
+            return -1
+        elf = f'elf/{implementation.path.replace("/", "_")}_{self.test_type}.elf'
+        size = subprocess.check_output(
+            [self.platform_settings.size_executable, elf],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        _, flashsize, ramsize = genskiplist.parse_flashsize(size)
+        try:
+            if "HardFault" in output or "ERROR" in output:
+                stackusage = self.failed_memory
+            else:
+                stackusage = genskiplist.parse_stackusage(output)
+        except Exception as e:
+            self.log.warning("Stack usage of %s not found: %s", implementation, e)
+            stackusage = self.failed_memory
+        estmemory = genskiplist.roundto(stackusage + ramsize + self.margin, self.round)
+        self.log.info("%s: flash %d, memory %d bytes", implementation, flashsize, estmemory)
+        self.cache.update(implementation, self.optflags, digest, estmemory, flashsize)
+        return 0
+
+    def test_all(self, args=[]):
+        implementations = [
+            implementation for implementation in self.select_implementations(args)
+            if not self.cache.is_fresh(implementation, self.optflags,
+                                       self.buildcache.input_hash(implementation, self.test_type))]
+        try:
+            return self.run_all(implementations)
+        finally:
+            self.cache.save()
+
+
 class TestVectors(BoardTestCase):
     test_type = 'testvectors'
 
+    #: checksums of the host testvectors with the input hash they belong to
+    checksumfile = "obj/.testvectors.json"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.testvectorhash = dict()
 
     def hash_output(self, output):
-        hash = hashlib.sha3_256(output.strip()).hexdigest()
-        return hash
+        hash = StrippedHash()
+        hash.update(output)
+        return hash.hexdigest()
 
     def run_test(self, implementation):
-        checksum = self.hash_output(
-            super().run_test(implementation).encode('utf-8'))
-        if self.testvectorhash[implementation.scheme] != checksum:
+        expected = self.testvectorhash.get(implementation.scheme)
+        if expected is None:
+            self.log.error("Test %s - %s Failed! No host testvectors", implementation, self.test_type)
+            return -1
+        hash = StrippedHash()
+        error = StreamSearch(b"ERROR")
+
+        def sink(data):
+            hash.update(data)
+            error.update(data)
+
+        # the output only goes to the sink, so it is searched as it streams
+        output = super().run_test(implementation, sink=sink)
+        if output == -1 or error.found:
+            self.log.error("Test %s - %s Failed!", implementation, self.test_type)
+            return -1
+        if expected != hash.hexdigest():
             self.log.error("Test %s - %s Failed!", implementation, self.test_type)
             return -1
         else:
             self.log.info("Test %s - %s Successful", implementation, self.test_type)
             return 0
 
+    def _host_checksum(self, impl, cache):
+        """Build and run the host testvectors of impl, returns (digest, checksum)"""
+        digest = cache.input_hash(impl, 'testvectors-host')
+        binpath = impl.get_binary_path(self.test_type)
+        hostbin = binpath.replace('bin/', 'bin-host/')
+        if impl.run_make(hostbin):
+            raise RuntimeError(f"make {hostbin} failed")
+        hash = StrippedHash()
+        with trace.span("host", hostbin), \
+                subprocess.Popen([hostbin], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL) as proc:
+            for chunk in iter(lambda: proc.stdout.read(65536), b""):
+                hash.update(chunk)
+        if proc.returncode:
+            raise RuntimeError(f"{hostbin} returned {proc.returncode}")
+        return digest, hash.hexdigest()
+
     def _prepare_testvectors(self, exclude, args):
         hostimpl = []
         for scheme, implementations in self.schemes.items():
@@ -372,92 +1150,125 @@ class TestVectors(BoardTestCase):
                     continue
                 hostimpl.append(impl)
                 break
-        with tqdm.tqdm(total=len(hostimpl), desc="Prep. testvectors") as pb:
-            for impl in hostimpl:
-                # Build host version
-                pb.set_postfix_str(f"{impl}")
-                self.log.info("Running %s on host", impl)
-                binpath = impl.get_binary_path(self.test_type)
-                hostbin = binpath.replace('bin/', 'bin-host/')
-                impl.run_make(hostbin)
+        try:
+            with open(self.checksumfile, "r") as f:
+                checksums = json.load(f)
+        except (OSError, ValueError):
+            checksums = dict()
+        cache = BuildCache()
+        pending = []
+        for impl in hostimpl:
+            digest, checksum = checksums.get(impl.scheme, (None, None))
+            if digest is not None and digest == cache.input_hash(impl, 'testvectors-host'):
+                self.log.info("Reusing host testvectors of %s", impl)
+                self.testvectorhash[impl.scheme] = checksum
+            else:
+                pending.append(impl)
+        jobs = getattr(self.platform_settings, "build_jobs", None) or os.cpu_count() or 1
+        with tqdm.tqdm(total=len(pending), desc="Prep. testvectors") as pb:
+            def done(impl, future):
                 try:
-                    checksum = self.hash_output(
-                        subprocess.check_output(
-                            [hostbin],
-                            stderr=subprocess.DEVNULL,
-                        ))
+                    digest, checksum = future.result()
+                    checksums[impl.scheme] = (digest, checksum)
+                    self.testvectorhash[impl.scheme] = checksum
                 except Exception as e:
                     self.log.error("Generating testvector for %s failed with exception: %s", impl, e)
-                self.testvectorhash[impl.scheme] = checksum
+                    checksums.pop(impl.scheme, None)
                 pb.update()
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+                # the first build also builds the host libraries, which must
+                # not be written by several make processes at once
+                if len(pending) > 0:
+                    first = pool.submit(self._host_checksum, pending[0], cache)
+                    concurrent.futures.wait([first])
+                    done(pending[0], first)
+                futures = {pool.submit(self._host_checksum, impl, cache): impl
+                           for impl in pending[1:]}
+                for future in concurrent.futures.as_completed(futures):
+                    done(futures[future], future)
+        os.makedirs(os.path.dirname(self.checksumfile), exist_ok=True)
+        with open(self.checksumfile, "w") as f:
+            json.dump(checksums, f, indent=0, sort_keys=True)
         return 0
 
     def test_all(self, args):
+        exclude = "--exclude" in args
         self.schemes = defaultdict(list)
-        for implementation in self.get_implementations(all=True):
+        for implementation in self.get_implementations(
+                all=True, schemes=[arg for arg in args if arg != "--exclude"], exclude=exclude):
             self.schemes[implementation.scheme].append(implementation)
 
-        implementations = []
-        exclude = "--exclude" in args
-        for implementation in self.get_implementations():
-            if exclude and implementation.scheme in args:
-                continue
-            if not exclude and len(args) > 0 and implementation.scheme not in args:
-                continue
-            implementations.append(implementation)
+        implementations = self.select_implementations(args)
 
         self._prepare_testvectors(exclude, args)
 
-        with tqdm.tqdm(total=len(implementations), desc=self.test_type) as pb:
-            for implementation in implementations:
-                pb.set_postfix_str(f"{implementation}")
-                if self.run_test(implementation) == -1:
-                    pb.write(f"{implementation} FAILED")
-                    return -1
-                pb.write(f"{implementation} SUCCESSFUL")
-                pb.update()
+        return self.run_all(implementations)
 
 
 class BuildAll(BoardTestCase):
+    test_types = ('test', 'testvectors', 'speed', 'hashing', 'stack')
 
-    def __init__(self, settings):
+    def __init__(self, settings, jobs=None):
         super().__init__(settings, None)
+        self.scheduler = BuildScheduler(settings, jobs)
 
     def run_test(self, implementation):
-        for test_type in ('test', 'testvectors', 'speed', 'hashing', 'stack'):
+        for test_type in self.test_types:
             implementation.build_binary(test_type,
                                         self.platform_settings.binary_type)
 
+    def test_all(self, args=[]):
+        implementations = self.select_implementations(args)
+        self.scheduler.build((implementation, test_type)
+                             for implementation in implementations
+                             for test_type in self.test_types)
+        if self.scheduler.report():
+            return -1
+
 class Converter(object):
+    def __init__(self, store=None, **filters):
+        """
+        Report the results in a ResultStore (by default benchmarks/results.sqlite)
+
+        filters restrict the report to runs with the given platform, optflags
+        or gitrev.
+        """
+        self.store = results.ResultStore() if store is None else store
+        self.filters = filters
+
     def convert(self):
+        # pick up result files written by the make run targets or old versions
+        self.store.import_tree()
         self._speed()
         self._stack()
         self._hashing()
         self._size()
+        self._profiling()
 
     def _speed(self):
         self._header("Speed Evaluation")
         self._subheader("Key Encapsulation Schemes")
         self._tablehead(["scheme", "implementation", "key generation [cycles]",
                          "encapsulation [cycles]", "decapsulation [cycles]"])
-        self._processPrimitives("benchmarks/speed/crypto_kem/", "speed", "crypto_kem")
+        self._processPrimitives("speed", "crypto_kem")
 
         self._subheader("Signature Schemes")
         self._tablehead(["scheme", "implementation", "key generation [cycles]",
                          "sign [cycles]", "verify [cycles]"])
-        self._processPrimitives("benchmarks/speed/crypto_sign/", "speed", "crypto_sign")
+        self._processPrimitives("speed", "crypto_sign")
 
     def _stack(self):
         self._header("Memory Evaluation")
         self._subheader("Key Encapsulation Schemes")
         self._tablehead(["Scheme", "Implementation", "Key Generation [bytes]",
                          "Encapsulation [bytes]", "Decapsulation [bytes]"])
-        self._processPrimitives("benchmarks/stack/crypto_kem/", "stack", "crypto_kem")
+        self._processPrimitives("stack", "crypto_kem")
 
         self._subheader("Signature Schemes")
         self._tablehead(["Scheme", "Implementation", "Key Generation [bytes]",
                          "Sign [bytes]", "Verify [bytes]"])
-        self._processPrimitives("benchmarks/stack/crypto_sign/", "stack", "crypto_sign")
+        self._processPrimitives("stack", "crypto_sign")
 
     def _hashing(self):
         """ prints the cycles spent in hashing and the percentage of the total
@@ -466,12 +1277,12 @@ class Converter(object):
         self._subheader("Key Encapsulation Schemes")
         self._tablehead(["Scheme", "Implementation", "Key Generation [%]",
                          "Encapsulation [%]", "Decapsulation [%]"])
-        self._processPrimitives("benchmarks/hashing/crypto_kem/", "hashing", "crypto_kem")
+        self._processPrimitives("hashing", "crypto_kem")
 
         self._subheader("Signature Schemes")
         self._tablehead(["Scheme", "Implementation", "Key Generation [%]",
                          "Sign [%]", "Verify [%]"])
-        self._processPrimitives("benchmarks/hashing/crypto_sign/", "hashing", "crypto_sign")
+        self._processPrimitives("hashing", "crypto_sign")
 
     def _size(self):
         """ prints the total number of bytes in the text, data, and bss sections
@@ -480,70 +1291,101 @@ class Converter(object):
         self._subheader("Key Encapsulation Schemes")
         self._tablehead(["Scheme", "Implementation", ".text [bytes]",
                          ".data [bytes]", ".bss [bytes]", "Total [bytes]"])
-        self._processPrimitives("benchmarks/size/crypto_kem/", "size", "crypto_kem")
+        self._processPrimitives("size", "crypto_kem")
 
         self._subheader("Signature Schemes")
         self._tablehead(["Scheme", "Implementation", ".text [bytes]",
                          ".data [bytes]", ".bss [bytes]", "Total [bytes]"])
-        self._processPrimitives("benchmarks/size/crypto_sign/", "size", "crypto_sign")
-
-
-    def _processPrimitives(self, path, benchmark, type_):
-        if os.path.exists(path) == False:
-            return;
-        data = dict()
-        for scheme in sorted(os.listdir(path)):
-            data[scheme] = dict()
-            for implementation in sorted(os.listdir(path+"/"+scheme)):
-                measurements = []
-                for measurement in os.listdir(path+"/"+scheme+"/"+implementation):
-                    with open(path+"/"+scheme+"/"+implementation+"/"+measurement, "r") as f:
-                        d = self._parseData(f.read(), benchmark, type_)
-                        measurements.append(d)
+        self._processPrimitives("size", "crypto_sign")
+
+    def _profiling(self):
+        """ prints the mean cycles spent in each named region and their share
+            of the operation; regions may be nested. The section is omitted if
+            there are no profiling results """
+        data = self.store.measurements("profiling", "crypto_kem", **self.filters)
+        if not data:
+            return
+        self._header("Profiling Evaluation")
+        self._subheader("Key Encapsulation Schemes")
+        self._tablehead(["Scheme", "Implementation", "Operation", "Region",
+                         "Calls", "Cycles (mean)", "Share [%]"])
+        for scheme, implementations in data.items():
+            for implementation, measurements in implementations.items():
+                for operation, region, calls, cycles, share in self._parseRegions(measurements):
+                    self._row([scheme, implementation, operation, region,
+                               self._formatNumber(calls), self._formatNumber(cycles),
+                               self._formatPercentage(share)])
+
+    def _parseRegions(self, measurements):
+        """ aggregates "<op> region <name> cycles/calls" over all iterations,
+            in the order the firmware reported them """
+        regions = defaultdict(lambda: defaultdict(list))
+        totals = defaultdict(list)
+        for metrics in measurements:
+            for metric, value in metrics.items():
+                operation, _, rest = metric.partition(" region ")
+                if rest:
+                    region, _, unit = rest.rpartition(" ")
+                    regions[(operation, region)][unit].append(value)
+                elif metric.endswith(" cycles"):
+                    totals[metric[:-len(" cycles")]].append(value)
+        rows = []
+        for (operation, region), values in regions.items():
+            if not values["cycles"] or not totals[operation]:
+                continue
+            cycles = statistics.mean(values["cycles"])
+            calls = statistics.mean(values["calls"]) if values["calls"] else 0
+            rows.append((operation, region, int(round(calls)), int(cycles),
+                         cycles / statistics.mean(totals[operation])))
+        return rows
+
+    def _processPrimitives(self, benchmark, type_):
+        data = self.store.measurements(benchmark, type_, **self.filters)
+        for scheme, implementations in data.items():
+            for implementation, measurements in implementations.items():
+                measurements[:] = [self._parseData(m, benchmark, type_) for m in measurements]
                 self._formatData(scheme, implementation, measurements, benchmark)
-                data[scheme][implementation] = measurements
         return data
 
     def _stats(self, data):
         return (int(statistics.mean(data)), min(data), max(data))
 
-    def _parseData(self, fileContents, benchmark, type_):
-        parts = fileContents.split("\n")
+    def _parseData(self, metrics, benchmark, type_):
         if benchmark == 'size':
-            text  = int(parts[parts.index(".text bytes:")+1])
-            data  = int(parts[parts.index(".data bytes:")+1])
-            bss   = int(parts[parts.index(".bss bytes:")+1])
-            total = int(parts[parts.index(".total bytes:")+1])
+            text  = metrics[".text bytes"]
+            data  = metrics[".data bytes"]
+            bss   = metrics[".bss bytes"]
+            total = metrics[".total bytes"]
             return [text, data, bss, total]
         elif benchmark == 'hashing':
-            keygentotal    = int(parts[parts.index("keypair cycles:")+1])
-            keygen         = int(parts[parts.index("keypair hash cycles:")+1])/keygentotal
+            keygentotal    = metrics["keypair cycles"]
+            keygen         = metrics["keypair hash cycles"]/keygentotal
             if type_ == "crypto_kem":
-                encsigntotal   = int(parts[parts.index("encaps cycles:")+1])
-                encsign        = int(parts[parts.index("encaps hash cycles:")+1])/encsigntotal
-                decverifytotal = int(parts[parts.index("decaps cycles:")+1])
-                decverify      = int(parts[parts.index("decaps hash cycles:")+1])/decverifytotal
+                encsigntotal   = metrics["encaps cycles"]
+                encsign        = metrics["encaps hash cycles"]/encsigntotal
+                decverifytotal = metrics["decaps cycles"]
+                decverify      = metrics["decaps hash cycles"]/decverifytotal
             else: #crypto_sign
-                encsigntotal   = int(parts[parts.index("sign cycles:")+1])
-                encsign        = int(parts[parts.index("sign hash cycles:")+1])/encsigntotal
-                decverifytotal = int(parts[parts.index("verify cycles:")+1])
-                decverify      = int(parts[parts.index("verify hash cycles:")+1])/decverifytotal
+                encsigntotal   = metrics["sign cycles"]
+                encsign        = metrics["sign hash cycles"]/encsigntotal
+                decverifytotal = metrics["verify cycles"]
+                decverify      = metrics["verify hash cycles"]/decverifytotal
         elif benchmark == 'speed':
-            keygen    = int(parts[parts.index("keypair cycles:")+1])
+            keygen    = metrics["keypair cycles"]
             if type_ == "crypto_kem":
-                encsign    = int(parts[parts.index("encaps cycles:")+1])
-                decverify    = int(parts[parts.index("decaps cycles:")+1])
+                encsign    = metrics["encaps cycles"]
+                decverify    = metrics["decaps cycles"]
             else: # crypto_sign
-                encsign    = int(parts[parts.index("sign cycles:")+1])
-                decverify    = int(parts[parts.index("verify cycles:")+1])
+                encsign    = metrics["sign cycles"]
+                decverify    = metrics["verify cycles"]
         else: # stack
-            keygen    = int(parts[parts.index("keypair stack usage:")+1])
+            keygen    = metrics["keypair stack usage"]
             if type_ == "crypto_kem":
-                encsign    = int(parts[parts.index("encaps stack usage:")+1])
-                decverify    = int(parts[parts.index("decaps stack usage:")+1])
+                encsign    = metrics["encaps stack usage"]
+                decverify    = metrics["decaps stack usage"]
             else: # crypto_sign
-                encsign     = int(parts[parts.index("sign stack usage:")+1])
-                decverify   = int(parts[parts.index("verify stack usage:")+1])
+                encsign     = metrics["sign stack usage"]
+                decverify   = metrics["verify stack usage"]
         return [keygen, encsign, decverify]
 
     def _formatData(self, scheme, implementation, data, benchmark):
@@ -615,14 +1457,14 @@ class CsvConverter(Converter):
                         [f"Encapsulation [cycles] ({x})" for x in ["mean", "min", "max"]] +
                         [f"Decapsulation [cycles] ({x})" for x in ["mean", "min", "max"]])
 
-        cyclesKem = self._processPrimitives("benchmarks/speed/crypto_kem/", "speed", "crypto_kem")
+        cyclesKem = self._processPrimitives("speed", "crypto_kem")
 
         self._subheader("Signature Schemes")
         self._tablehead(["Scheme", "Implementation"]+
                         [f"Key Generation [cycles] ({x})" for x in ["mean", "min", "max"]] +
                         [f"Sign [cycles] ({x})" for x in ["mean", "min", "max"]] +
                         [f"Verify [cycles] ({x})" for x in ["mean", "min", "max"]])
-        cyclesSign = self._processPrimitives("benchmarks/speed/crypto_sign/", "speed", "crypto_sign")
+        cyclesSign = self._processPrimitives("speed", "crypto_sign")
         return (cyclesKem, cyclesSign)
 
     def _row(self, data):
@@ -1,28 +1,101 @@
 from mupq import mupq
+from mupq import trace
 
 import abc
-import re
-import serial
+import selectors
 import subprocess
 import time
 import os
 import tqdm
 
-try:
-    import chipwhisperer as cw
-except ImportError:
-    pass
+# pyserial and chipwhisperer are imported by the platforms that need them,
+# they are slow to import and not needed for the emulator
+
+
+class FrameReader(object):
+    """
+    Incremental framing of the output of a test binary
+
+    The output of interest follows a line of at least four equal signs and
+    ends with a '#'. Every call of feed() only scans the new bytes for the
+    markers and counts the '+' progress markers of finished iterations, so a
+    run costs linear time in its output. Bytes before the start line are
+    dropped as they arrive.
+
+    With a sink, the output is handed to sink(bytes) as it arrives instead of
+    being kept, output() is then empty.
+    """
+
+    start_marker = b"====\n"
+    end_marker = b"#"
+    progress_marker = b"+"
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.buffer = bytearray()
+        #: offsets of the output in buffer, None until the markers are seen
+        self.start = None
+        self.end = None
+        #: number of progress markers seen so far
+        self.progress = 0
+        self._scanned = 0
+
+    @property
+    def started(self):
+        return self.start is not None
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, data):
+        """Append data, returns the number of new progress markers"""
+        if self.done:
+            return 0
+        self.buffer += data
+        if self.start is None:
+            # the marker may straddle the previous chunk
+            found = self.buffer.find(self.start_marker, max(self._scanned - len(self.start_marker), 0))
+            if found < 0:
+                keep = len(self.start_marker) - 1
+                del self.buffer[:max(len(self.buffer) - keep, 0)]
+                self._scanned = len(self.buffer)
+                return 0
+            self.start = found + len(self.start_marker)
+            self._scanned = self.start
+        end = self.buffer.find(self.end_marker, self._scanned)
+        limit = len(self.buffer) if end < 0 else end
+        new = self.buffer.count(self.progress_marker, self._scanned, limit)
+        self.progress += new
+        if self.sink is not None:
+            if limit > self._scanned:
+                self.sink(bytes(memoryview(self.buffer)[self._scanned:limit]))
+            del self.buffer[:limit]
+            self.start = 0
+            limit = 0
+        self._scanned = limit
+        if end >= 0:
+            self.end = limit
+        return new
+
+    def output(self):
+        """The framed output (without the markers) as bytes"""
+        if not self.done:
+            return None
+        return bytes(memoryview(self.buffer)[self.start:self.end])
 
 
 class Qemu(mupq.Platform):
 
-    start_pat = re.compile('.*={4,}\n', re.DOTALL)
-    end_pat = re.compile('#\n', re.DOTALL)
-
-    def __init__(self, qemu, machine):
+    def __init__(self, qemu, machine, timeout=None):
+        """
+        timeout is the deadline per expected iteration in seconds, a run that
+        takes longer is killed (None waits forever)
+        """
         super().__init__()
         self.qemu = qemu
         self.machine = machine
+        self.timeout = timeout
         self.platformname = "qemu"
 
     def __enter__(self):
@@ -31,7 +104,8 @@ class Qemu(mupq.Platform):
     def __exit__(self, *args, **kwargs):
         return super().__exit__(*args, **kwargs)
 
-    def run(self, binary_path, expiterations=1):
+    def run(self, binary_path, expiterations=1, flash=True, sink=None):
+        # every run boots a fresh emulator, there is nothing to flash
         if expiterations > 1:
             pb = tqdm.tqdm(total=expiterations, leave=False, desc="Running...")
         args = [
@@ -43,45 +117,79 @@ class Qemu(mupq.Platform):
             "-kernel",
             binary_path,
         ]
+        self.flash_time = 0.0
+        started = time.monotonic()
+        deadline = None
+        if self.timeout is not None:
+            deadline = started + self.timeout * expiterations
         self.log.info(f'Running QEMU: {" ".join(args)}')
+        proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        reader = FrameReader(sink)
         try:
-            proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="ascii")
-            output = ""
-            while "#" not in output:
-                buf = proc.stdout.readline()
-                # print(buf)
-                output += buf
-                if expiterations > 1:
-                    if "+" in buf:
-                        pb.update(buf.count("+"))
-                    else:
-                        pb.refresh()
-            proc.wait()
-        except Exception:
+            with selectors.DefaultSelector() as selector:
+                selector.register(proc.stdout, selectors.EVENT_READ)
+                while True:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"{binary_path} did not finish within "
+                                               f"{self.timeout * expiterations}s")
+                    if not selector.select(remaining):
+                        continue
+                    buf = os.read(proc.stdout.fileno(), 65536)
+                    if len(buf) == 0:
+                        # QEMU exited before the end marker
+                        break
+                    progress = reader.feed(buf)
+                    if expiterations > 1:
+                        if progress:
+                            pb.update(progress)
+                        else:
+                            pb.refresh()
+                    if reader.done:
+                        break
             try:
-                if proc and proc.poll is not None:
-                    proc.kill()
-            except Exception:
-                pass
-            raise
-        start = self.start_pat.search(output)
-        end = self.end_pat.search(output, start.end())
-        if end is None:
+                proc.wait(None if deadline is None else max(deadline - time.monotonic(), 1))
+            except subprocess.TimeoutExpired:
+                self.log.warning("QEMU did not exit after %s finished", binary_path)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            if expiterations > 1:
+                pb.close()
+            self.run_time = time.monotonic() - started
+            trace.tracer.add("run", binary_path, started, self.run_time)
+        # QEMU died before the start or end marker
+        if not reader.done:
             return 'ERROR'
-        proc.wait()
-        if expiterations > 1:
-            pb.close()
-        return output[start.end():end.start()]
+        return reader.output().decode("ascii", "ignore")
 
 
-class SerialCommsPlatform(mupq.Platform):
+class QemuPool(mupq.PlatformPool):
+    """Several QEMU instances running tests in parallel, at most one per core"""
+
+    def __init__(self, qemu, machine, instances=None, timeout=None):
+        cores = os.cpu_count() or 1
+        if instances is None or instances < 1:
+            instances = cores
+        super().__init__(Qemu(qemu, machine, timeout) for _ in range(min(instances, cores)))
 
-    # Start pattern is at least five equal signs
-    start_pat = re.compile(b'.*={4,}\n', re.DOTALL)
 
-    def __init__(self, tty="/dev/ttyACM0", baud=38400, timeout=1):
+class SerialCommsPlatform(mupq.Platform):
+
+    def __init__(self, tty="/dev/ttyACM0", baud=38400, timeout=1, run_timeout=None):
+        """
+        timeout is the read timeout of the serial port, run_timeout the
+        deadline per expected iteration in seconds as for Qemu (None waits
+        forever once the output started)
+        """
+        import serial
         super().__init__()
         self._dev = serial.Serial(tty, baud, timeout=timeout)
+        self.run_timeout = run_timeout
 
     def __enter__(self):
         return super().__enter__()
@@ -90,71 +198,99 @@ class SerialCommsPlatform(mupq.Platform):
         self._dev.close()
         return super().__exit__(*args, **kwargs)
 
-    def run(self, binary_path, expiterations=1):
+    def run(self, binary_path, expiterations=1, flash=True, sink=None):
         if expiterations > 1:
             pb = tqdm.tqdm(total=expiterations, leave=False, desc="Running...")
         self._dev.reset_input_buffer()
-        self.flash(binary_path)
-        # Wait for the first equal sign
-        if self._dev.read_until(b'=')[-1] != b'='[0]:
-            raise RuntimeError('Timout waiting for start')
-        # Wait for the end of the equal delimiter
-        start = self._dev.read_until(b'\n')
-        self.log.debug(f'Found start pattern: {start}')
-        if self.start_pat.fullmatch(start) is None:
-            raise RuntimeError('Start does not match')
-        # Wait for the end
-        output = bytearray()
-        while len(output) == 0 or output[-1] != b'#'[0]:
-            data = self._dev.read_until(b'#', 128)
+        if not self.load(binary_path, flash):
+            with trace.span("reset", binary_path):
+                self.reset()
+        started = time.monotonic()
+        deadline = None
+        if self.run_timeout is not None:
+            deadline = started + self.run_timeout * expiterations
+        reader = FrameReader(sink)
+        while not reader.done:
+            # whatever arrived, but block for at least one byte
+            data = self._dev.read(max(self._dev.in_waiting, 1))
+            if not data and not reader.started:
+                raise RuntimeError('Timeout waiting for start')
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{binary_path} did not finish within "
+                                   f"{self.run_timeout * expiterations}s")
+            progress = reader.feed(data)
             if expiterations > 1:
-                if b"+" in data:
-                    pb.update(data.count(b"+"))
+                if progress:
+                    pb.update(progress)
                 else:
                     pb.refresh()
-            output.extend(data)
         if expiterations > 1:
             pb.close()
-        return output[:-1].decode('utf-8', 'ignore')
+        self.run_time = time.monotonic() - started
+        trace.tracer.add("run", binary_path, started, self.run_time)
+        return reader.output().decode('utf-8', 'ignore')
 
     @abc.abstractmethod
     def flash(self, binary_path):
         pass
 
+    @abc.abstractmethod
+    def reset(self):
+        """Restart the binary on the target without flashing it again"""
+        pass
+
 
 class OpenOCD(SerialCommsPlatform):
-    def __init__(self, script, tty="/dev/ttyACM0", baud=38400, timeout=60):
-        super().__init__(tty, baud, timeout)
+    def __init__(self, script, tty="/dev/ttyACM0", baud=38400, timeout=60, probe=None, run_timeout=None):
+        super().__init__(tty, baud, timeout, run_timeout)
         self.script = script
+        self.probe = probe
 
-    def flash(self, binary_path):
+    def _openocd(self, command):
+        # select the debug probe of this board if several are connected
+        extraargs = [] if self.probe is None else ["-c", f"adapter serial {self.probe}"]
         subprocess.check_call(
-            ["openocd", "-f", self.script, "-c", f"program {binary_path} verify reset exit"],
+            ["openocd", "-f", self.script] + extraargs + ["-c", command],
             # stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
 
+    def flash(self, binary_path):
+        self._openocd(f"program {binary_path} verify reset exit")
+
+    def reset(self):
+        self._openocd("init; reset run; exit")
+
 
 class StLink(SerialCommsPlatform):
-    def flash(self, binary_path):
+    def __init__(self, tty="/dev/ttyACM0", baud=38400, timeout=1, probe=None, run_timeout=None):
+        super().__init__(tty, baud, timeout, run_timeout)
+        self.probe = probe
+
+    def _st_flash(self, command):
         extraargs = []
         if os.getenv("MUPQ_ST_FLASH_ARGS") is not None:
             extraargs = os.getenv("MUPQ_ST_FLASH_ARGS").split()
+        if self.probe is not None:
+            # select the ST-Link of this board if several are connected
+            extraargs += ["--serial", self.probe]
         subprocess.check_call(
-            ["st-flash"] + extraargs + ["--reset", "write", binary_path, "0x8000000"],
+            ["st-flash"] + extraargs + command,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
 
+    def flash(self, binary_path):
+        self._st_flash(["--reset", "write", binary_path, "0x8000000"])
 
-class ChipWhisperer(mupq.Platform):
+    def reset(self):
+        self._st_flash(["reset"])
 
-    # Start pattern is at least five equal signs
-    start_pat = re.compile('.*={4,}\n', re.DOTALL)
-    # End pattern is a hash with a newline
-    end_pat = re.compile('.*#\n', re.DOTALL)
+
+class ChipWhisperer(mupq.Platform):
 
     def __init__(self):
+        import chipwhisperer as cw
         super().__init__()
         self.platformname = "cw"
         self.scope = cw.scope()
@@ -178,6 +314,7 @@ class ChipWhisperer(mupq.Platform):
         time.sleep(0.05)
 
     def flash(self, binary_path):
+        import chipwhisperer as cw
         prog = cw.programmers.STM32FProgrammer()
         prog.scope = self.scope
         prog.open()
@@ -186,36 +323,23 @@ class ChipWhisperer(mupq.Platform):
         prog.program(binary_path, memtype="flash", verify=False)
         prog.close()
 
-    def run(self, binary_path, expiterations=1):
+    def run(self, binary_path, expiterations=1, flash=True, sink=None):
         if expiterations > 1:
             pb = tqdm.tqdm(total=expiterations, leave=False, desc="Running...")
-        self.flash(binary_path)
+        self.load(binary_path, flash)
+        started = time.monotonic()
         self.target.flush()
         self.reset_target()
-        data = ''
-        # Wait for the first equal sign
-        while '=' not in data:
-            data += self.target.read()
-        # Wait for the end of the equal delimiter
-        match = None
-        while match is None:
-            buf = self.target.read()
-            data += buf
-            match = self.start_pat.match(data)
-        # Remove the start pattern
-        data = data[match.end():]
-        # Wait for the end
-        match = None
-        while match is None:
-            buf = self.target.read()
-            data += buf
+        reader = FrameReader(sink)
+        while not reader.done:
+            progress = reader.feed(self.target.read().encode('latin-1'))
             if expiterations > 1:
-                if "+" in buf:
-                    pb.update(buf.count("+"))
+                if progress:
+                    pb.update(progress)
                 else:
                     pb.refresh()
-            match = self.end_pat.match(data)
-        # Remove stop pattern and return
         if expiterations > 1:
             pb.close()
-        return data[:match.end() - 2]
+        self.run_time = time.monotonic() - started
+        trace.tracer.add("run", binary_path, started, self.run_time)
+        return reader.output().decode('latin-1')
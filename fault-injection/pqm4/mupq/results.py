@@ -0,0 +1,229 @@
+"""
+SQLite store for benchmark results
+
+Every benchmark run is a row in `runs` (scheme, implementation, platform,
+optimization flags, git revision, raw output, flash and run time), every number it reported is a
+row in `results` (run, iteration, metric, value). The `measurements` view joins
+both into one flat table. Result files in the old benchmarks/ tree (and the
+`frommake` files written by the make run targets) are imported incrementally.
+"""
+import logging
+import os
+import os.path
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from mupq import trace
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    benchmark TEXT NOT NULL,
+    primitive TEXT NOT NULL,
+    scheme TEXT NOT NULL,
+    implementation TEXT NOT NULL,
+    platform TEXT,
+    optflags TEXT,
+    gitrev TEXT,
+    timestamp TEXT NOT NULL,
+    source TEXT,
+    output TEXT,
+    flash_time REAL,
+    run_time REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    iteration INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imported (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_scheme
+    ON runs (benchmark, primitive, scheme, implementation);
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run);
+CREATE VIEW IF NOT EXISTS measurements AS
+    SELECT runs.benchmark, runs.primitive, runs.scheme, runs.implementation,
+           runs.platform, runs.optflags, runs.gitrev, runs.timestamp,
+           results.run, results.iteration, results.metric, results.value
+    FROM results JOIN runs ON results.run = runs.id;
+"""
+
+
+def parse_output(output):
+    """
+    Split benchmark output into iterations of (metric, value) pairs
+
+    Iterations are separated by '+'. A metric is a line ending with a colon
+    that is followed by a line holding an integer, e.g., "keypair cycles:".
+    """
+    iterations = output.split("+")
+    if len(iterations) > 1:
+        # the output ends with a separator
+        iterations = iterations[:-1]
+    parsed = []
+    for iteration in iterations:
+        lines = [line.strip() for line in iteration.split("\n")]
+        metrics = []
+        for label, value in zip(lines, lines[1:]):
+            if not label.endswith(":"):
+                continue
+            try:
+                metrics.append((label[:-1], int(value)))
+            except ValueError:
+                continue
+        parsed.append(metrics)
+    return parsed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ResultStore(object):
+    """Benchmark results of all runs in one SQLite database"""
+
+    #: database file, next to the legacy result tree
+    dbfile = "benchmarks/results.sqlite"
+
+    def __init__(self, dbfile=None):
+        self.log = logging.getLogger(__class__.__name__)
+        if dbfile is not None:
+            self.dbfile = dbfile
+        self.lock = threading.Lock()
+        self._gitrev = None
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            # databases of older versions lack the timing columns
+            columns = {row[1] for row in db.execute("PRAGMA table_info(runs)")}
+            for column in ("flash_time", "run_time"):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE runs ADD COLUMN {column} REAL")
+
+    def _connect(self):
+        directory = os.path.dirname(self.dbfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.dbfile, timeout=60)
+        db.execute("PRAGMA foreign_keys = ON")
+        return db
+
+    def gitrev(self):
+        if self._gitrev is None:
+            self._gitrev = git_revision() or ""
+        return self._gitrev
+
+    def _insert(self, db, benchmark, primitive, scheme, implementation, output,
+                platform=None, optflags=None, gitrev=None, timestamp=None, source=None,
+                flash_time=None, run_time=None):
+        if timestamp is None:
+            timestamp = datetime.fromtimestamp(time.time()).strftime('%Y%m%d%H%M%S')
+        cursor = db.execute(
+            "INSERT INTO runs (benchmark, primitive, scheme, implementation, platform,"
+            " optflags, gitrev, timestamp, source, output, flash_time, run_time)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (benchmark, primitive, scheme, implementation, platform, optflags,
+             gitrev, timestamp, source, output, flash_time, run_time))
+        run = cursor.lastrowid
+        db.executemany(
+            "INSERT INTO results (run, iteration, metric, value) VALUES (?, ?, ?, ?)",
+            [(run, idx, metric, value)
+             for idx, metrics in enumerate(parse_output(output))
+             for metric, value in metrics])
+        return run
+
+    def add_run(self, benchmark, implementation, output, platform=None, optflags=None,
+                flash_time=None, run_time=None):
+        """
+        Store the output of one benchmark run of an Implementation
+
+        flash_time and run_time are the seconds spent flashing (0 if the image
+        was already on the target) and running the binary.
+        """
+        with trace.span("store", f"{implementation} - {benchmark}"), \
+                self.lock, self._connect() as db:
+            return self._insert(db, benchmark, implementation.primitive,
+                                implementation.scheme, implementation.implementation,
+                                output, platform, optflags, self.gitrev(),
+                                flash_time=flash_time, run_time=run_time)
+
+    def import_tree(self, path="benchmarks"):
+        """
+        Import result files of the benchmarks/<benchmark>/<primitive>/<scheme>/<impl>/
+        tree that are new or changed since the last import
+        """
+        if not os.path.isdir(path):
+            return 0
+        count = 0
+        with self.lock, self._connect() as db:
+            imported = dict(db.execute("SELECT path, mtime FROM imported"))
+            for benchmark in sorted(os.listdir(path)):
+                for primitive in self._subdirs(path, benchmark):
+                    for scheme in self._subdirs(path, benchmark, primitive):
+                        for implementation in self._subdirs(path, benchmark, primitive, scheme):
+                            folder = os.path.join(path, benchmark, primitive, scheme, implementation)
+                            for measurement in sorted(os.listdir(folder)):
+                                filename = os.path.join(folder, measurement)
+                                mtime = os.path.getmtime(filename)
+                                if imported.get(filename) == mtime:
+                                    continue
+                                with open(filename, "r") as f:
+                                    output = f.read()
+                                db.execute("DELETE FROM runs WHERE source = ?", (filename,))
+                                self._insert(db, benchmark, primitive, scheme, implementation,
+                                             output, timestamp=measurement, source=filename)
+                                db.execute("INSERT OR REPLACE INTO imported (path, mtime) VALUES (?, ?)",
+                                           (filename, mtime))
+                                count += 1
+        if count:
+            self.log.info("Imported %d result files from %s", count, path)
+        return count
+
+    @staticmethod
+    def _subdirs(*parts):
+        folder = os.path.join(*parts)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d)))
+
+    def measurements(self, benchmark, primitive, **filters):
+        """
+        All measurements of a benchmark as {scheme: {implementation: [metrics]}}
+
+        Each entry of the list is a dict metric -> value of one iteration of
+        one run. Further columns of `runs` (platform, optflags, gitrev) can be
+        given as keyword filters.
+        """
+        query = ("SELECT runs.scheme, runs.implementation, results.run, results.iteration,"
+                 " results.metric, results.value"
+                 " FROM results JOIN runs ON results.run = runs.id"
+                 " WHERE runs.benchmark = ? AND runs.primitive = ?")
+        params = [benchmark, primitive]
+        for column, value in filters.items():
+            if column not in ("platform", "optflags", "gitrev"):
+                raise ValueError(f"Cannot filter by {column}")
+            query += f" AND runs.{column} = ?"
+            params.append(value)
+        query += " ORDER BY runs.scheme, runs.implementation, results.run, results.iteration"
+        data = defaultdict(lambda: defaultdict(list))
+        with self.lock, self._connect() as db:
+            last = None
+            for scheme, implementation, run, iteration, metric, value in db.execute(query, params):
+                if (run, iteration) != last:
+                    data[scheme][implementation].append(dict())
+                    last = (run, iteration)
+                data[scheme][implementation][-1][metric] = value
+        return data
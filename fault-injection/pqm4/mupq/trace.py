@@ -0,0 +1,97 @@
+"""
+Timing spans of a harness session
+
+The harness records a span for every make invocation, flash, reset, board
+run, test and result parsing in the module-level `tracer`. At the end of a
+session the spans can be written as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev) and summarized per category:
+
+    from mupq import trace
+    with trace.span("make", target):
+        ...
+    trace.tracer.write("trace.json")
+    trace.tracer.print_summary()
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+
+Span = namedtuple("Span", ["category", "name", "thread", "start", "duration", "args"])
+
+
+class Tracer(object):
+    """Collects the spans of all threads of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, category, name, **args):
+        """Records the time spent in the with block"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(category, name, start, time.monotonic() - start, **args)
+
+    def add(self, category, name, start, duration, **args):
+        """Records a span that started at time.monotonic() value start"""
+        span = Span(category, str(name), threading.current_thread().name,
+                    start - self.origin, duration, args)
+        with self.lock:
+            self.spans.append(span)
+
+    def chrome_trace(self):
+        """The spans in the Chrome trace event format"""
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+        threads = {name: tid for tid, name in enumerate(dict.fromkeys(s.thread for s in spans))}
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                   "args": {"name": name}} for name, tid in threads.items()]
+        for s in spans:
+            events.append({
+                "name": s.name, "cat": s.category, "ph": "X", "pid": pid,
+                "tid": threads[s.thread], "ts": s.start * 1e6, "dur": s.duration * 1e6,
+                "args": {k: str(v) for k, v in s.args.items()}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """[(category, count, total, mean, max)] in seconds, largest total first"""
+        durations = defaultdict(list)
+        with self.lock:
+            for s in self.spans:
+                durations[s.category].append(s.duration)
+        rows = [(category, len(d), sum(d), sum(d) / len(d), max(d))
+                for category, d in durations.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def print_summary(self):
+        wall = time.monotonic() - self.origin
+        print(f"{'category':<10} {'count':>6} {'total [s]':>10} {'mean [s]':>9} {'max [s]':>9}")
+        for category, count, total, mean, maximum in self.summary():
+            print(f"{category:<10} {count:>6} {total:>10.2f} {mean:>9.3f} {maximum:>9.3f}")
+        print(f"session wall time {wall:.2f}s (spans of concurrent workers add up)")
+
+    def export(self, path):
+        """Write the Chrome trace to path and print the summary"""
+        self.write(path)
+        self.print_summary()
+
+
+#: spans of this session
+tracer = Tracer()
+
+
+def span(category, name, **args):
+    return tracer.span(category, name, **args)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Measures the startup time of the harness. Every command runs in a fresh
+interpreter; the median and maximum over several runs are reported.
+
+    python3 startup_benchmark.py -n 20
+
+Use `python3 -X importtime -c "import interface"` to see which import is slow.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ("python", ["-c", "pass"]),
+    ("import mupq.mupq", ["-c", "from mupq import mupq"]),
+    ("import interface", ["-c", "import interface"]),
+    ("get_platform mps2-an386",
+     ["-c", "import interface; args, _ = interface.parse_arguments(); interface.get_platform(args)",
+      "-p", "mps2-an386"]),
+    ("select one scheme",
+     ["-c", "import interface; from mupq import mupq; args, _ = interface.parse_arguments();"
+      "platform, settings = interface.get_platform(args);"
+      "mupq.SimpleTest(settings, platform).select_implementations(['bikel1'])",
+      "-p", "mps2-an386"]),
+    ("convert_benchmarks.py md", ["convert_benchmarks.py", "md"]),
+]
+
+
+def measure(argv, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.monotonic()
+        subprocess.run([sys.executable] + argv, check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.monotonic() - start)
+    return statistics.median(durations), max(durations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the harness",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Runs per command (default 10)")
+    args = parser.parse_args()
+    print(f"| {'command':<25} | median [ms] | max [ms] |")
+    print(f"| {'-' * 25} | ----------- | -------- |")
+    for name, argv in COMMANDS:
+        median, maximum = measure(argv, args.runs)
+        print(f"| {name:<25} | {median * 1000:>11.0f} | {maximum * 1000:>8.0f} |")
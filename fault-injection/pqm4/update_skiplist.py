@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Measures the memory usage of the stack binaries on the mps2-an386 emulator and
+caches the estimates in skiplist.json, per set of optimization flags. The test
+scripts skip implementations whose estimate exceeds the memory of the board.
+Only implementations whose sources changed since their last measurement are
+run again.
+
+    python3 update_skiplist.py bikel1 bikel3
+    python3 update_skiplist.py --lto --boards 4
+"""
+import argparse
+import sys
+
+from mupq import mupq
+from interface import parse_arguments, get_platform
+
+if __name__ == "__main__":
+    args, rest = parse_arguments()
+    # the estimates are measured on the emulator, independent of --platform
+    args.platform = "mps2-an386"
+    extra = argparse.ArgumentParser(epilog=__doc__)
+    extra.add_argument("-r", "--round", type=int, default=1024, help="Round up the usage to N bytes")
+    extra.add_argument("-m", "--margin", type=int, default=32, help="Add N bytes of additional stack margin")
+    extra_args, schemes = extra.parse_known_args(rest)
+    platform, settings = get_platform(args)
+    with platform:
+        test = mupq.SkipListUpdate(settings, platform, extra_args.margin, extra_args.round)
+        if test.test_all(schemes):
+            sys.exit(1)